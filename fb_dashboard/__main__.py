@@ -1,18 +1,20 @@
 import toml
-import time
 import argparse
 import sys
+import time
 from datetime import datetime as dt
 from .util import eval_expr
 from .framebuffer import FrameBufferBase, LinuxFrameBuffer
-from .widgets.image import ImageWidget
-from .widgets.text import TextWidget
-from .widgets.cloudwatch_metric import CloudWatchImageWidget
-from .widgets.clock import ClockWidget
-from .widgets.stock_candlestick import YFCandlestickWidget
-from .widgets.satellite import SatelliteWidget
-from .widgets.big_metric import BigMetricWidget
-from .widgets.weather import WeatherWidget
+from .compositor import Compositor
+from .scheduler import Scheduler
+from .executor import (
+    configure_executor,
+    configure_process_pool,
+    DEFAULT_MAX_WORKERS,
+)
+from .registry import WidgetRegistry, ImportProfiler
+from .metrics import serve_metrics
+from .widgets.metrics_overlay import MetricsOverlayWidget
 
 if __name__ == "__main__":
     args = argparse.ArgumentParser()
@@ -20,6 +22,12 @@ if __name__ == "__main__":
     args.add_argument("--fb", help="Name of the framebuffer device", default="fb0")
     args.add_argument("--debug", help="Enable debug mode", action="store_true")
     args.add_argument("--fake-fb-size", help="When using --no-framebuffer, set the size of the fake framebuffer", default="2160x1440")
+    args.add_argument(
+        "--fake-fb-bits-per-pixel",
+        help="When using --no-framebuffer, set the bit depth of the fake framebuffer (16, 24 or 32)",
+        type=int,
+        default=32,
+    )
     args.add_argument(
         "--export-filename",
         help="Export the framebuffer to a PNG file",
@@ -33,19 +41,56 @@ if __name__ == "__main__":
     args.add_argument(
         "--exit", help="Exit after writing the framebuffer", action="store_true"
     )
+    args.add_argument(
+        "--refresh-workers",
+        help="Number of threads shared by all widget refreshes",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+    )
+    args.add_argument(
+        "--render-processes",
+        help="Number of worker processes for widgets with executor = 'process', defaults to the number of CPUs",
+        type=int,
+        default=None,
+    )
+    args.add_argument(
+        "--no-page-flip",
+        help="Always copy into the visible framebuffer, instead of double buffering with FBIOPAN_DISPLAY",
+        action="store_true",
+    )
+    args.add_argument(
+        "--profile-startup",
+        help="Print how long startup took, and which modules were the slowest to import",
+        action="store_true",
+    )
+    args.add_argument(
+        "--metrics-port",
+        help="Serve per-widget timings and counters in the Prometheus text format on localhost:PORT",
+        type=int,
+        default=None,
+    )
+    args.add_argument(
+        "--metrics-socket",
+        help="Write the metrics to every connection on this Unix socket, e.g. `nc -U PATH`",
+        default=None,
+    )
+    args.add_argument(
+        "--metrics-overlay",
+        help="Draw every widget's render time and counters on top of the dashboard",
+        action="store_true",
+    )
     args = args.parse_args()
+
+    profiler = None
+    if args.profile_startup:
+        profiler = ImportProfiler()
+        profiler.install()
+        startup_began = time.perf_counter()
     config = toml.load(args.config)
+    configure_executor(args.refresh_workers)
+    configure_process_pool(args.render_processes)
 
-    plugins = {
-        "Image": ImageWidget,
-        "Text": TextWidget,
-        "Clock": ClockWidget,
-        "Metric": BigMetricWidget,
-        "StockMarketCandlestick": YFCandlestickWidget,
-        "CloudWatchMetricImage": CloudWatchImageWidget,
-        "SatelliteMap": SatelliteWidget,
-        "Weather": WeatherWidget,
-    }
+    registry = WidgetRegistry()
 
     if args.no_framebuffer:
         if args.fake_fb_size:
@@ -53,9 +98,16 @@ if __name__ == "__main__":
         else:
             (width, height) = (2160, 1440)
 
-        fb = FrameBufferBase(width, height, export_filename=args.export_filename)
+        fb = FrameBufferBase(
+            width,
+            height,
+            bits_per_pixel=args.fake_fb_bits_per_pixel,
+            export_filename=args.export_filename,
+        )
     else:
-        fb = LinuxFrameBuffer(args.fb)  # create the framebuffer
+        fb = LinuxFrameBuffer(
+            args.fb, page_flip=not args.no_page_flip
+        )  # create the framebuffer
 
     widgets = []
     # initialize widgets
@@ -74,31 +126,68 @@ if __name__ == "__main__":
             f"Creating widget of type {kind} at ({x}, {y}) with size ({width}, {height})"
         )
 
-        if kind in plugins:
-            widget = plugins[kind](x, y, width, height, config)
+        if profiler:
+            widget_class = profiler.timed("widget type %s" % kind, registry.get, kind)
+        else:
+            widget_class = registry.get(kind)
+
+        if widget_class:
+            widget = widget_class(x, y, width, height, config)
+            widget.name = widget_name
+            widget.pixel_format = fb.pixel_format
             widgets.append(widget)
         else:
             print(f"Unknown widget type: {kind}")
+            print("Known types: %s" % ", ".join(registry.types()))
             exit(1)
 
+    if profiler:
+        profiler.uninstall()
+        print(
+            "Startup took %.1f ms, slowest imports:"
+            % ((time.perf_counter() - startup_began) * 1000)
+        )
+        for line in profiler.report():
+            print(line)
+
+    overlay = None
+    if args.metrics_overlay:
+        size = max(10, fb.fb_height // 60)
+        overlay = MetricsOverlayWidget(
+            0,
+            0,
+            fb.fb_width // 2,
+            round(size * 1.3) * (len(widgets) + 3),
+            {"refresh_interval": 2, "size": size},
+        )
+        overlay.name = "metrics_overlay"
+        overlay.pixel_format = fb.pixel_format
+        # drawn last, so it stays on top
+        widgets.append(overlay)
+        overlay.widgets = widgets
+
+    compositor = Compositor(fb, widgets)
+    if overlay:
+        overlay.compositor = compositor
+
+    if args.metrics_port or args.metrics_socket:
+        serve_metrics(
+            widgets, compositor, port=args.metrics_port, socket_path=args.metrics_socket
+        )
+    scheduler = Scheduler(widgets)
+
     while True:
-        # trigger a widget refresh
+        # trigger refreshes for widgets that are due
         # print('%s: refreshing widgets' % (str(dt.now())))
         now = dt.now()
-        for widget in widgets:
-            widget.refresh_in_bg_if_needed()
+        scheduler.start_due_refreshes()
         # print('%s: done refreshing widgets (elapsed %s)' % (str(dt.now()), round((dt.now() - now).total_seconds(), 2)))
 
-        # write widgets into framebuffer
-        # print('%s: writing widgets into framebuffer' % (str(dt.now())))
+        # write changed widgets into the virtual buffer, and copy the dirty regions into the real one
+        # print('%s: compositing widgets into framebuffer' % (str(dt.now())))
         now = dt.now()
-        for widget in widgets:
-            widget.write_into_fb(fb)
-        # print('%s: done writing widgets into framebuffer (elapsed %s)' % (str(dt.now()), round((dt.now() - now).total_seconds(), 2)))
-
-        # copy our virtual buffer with the real one
-        fb.swap_buffers()
-        fb.make_buffer()
+        compositor.compose()
+        # print('%s: done compositing widgets into framebuffer (elapsed %s)' % (str(dt.now()), round((dt.now() - now).total_seconds(), 2)))
 
         # for testing, exit after all widgets have refreshed for the first time
         # --exit flag must be set to use this
@@ -110,7 +199,9 @@ if __name__ == "__main__":
                     break
 
             if all_rendered:
+                # a refresh may have landed after this frame was composited
+                compositor.compose()
                 sys.exit(0)
 
-        # wait for a bit
-        time.sleep(0.25)
+        # sleep until the next refresh is due, or a refresh finishes
+        scheduler.wait()
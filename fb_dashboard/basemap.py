@@ -0,0 +1,146 @@
+import json
+import os
+from hashlib import sha256
+import numpy as np
+from PIL import Image, ImageDraw
+
+# bump when the vertex or image cache layout changes
+BASEMAP_CACHE_VERSION = 1
+
+# where the vertex and image caches are written, None for next to the geojson
+CACHE_DIR = None
+
+
+def cache_path_for(geojson_path, name):
+    return os.path.join(CACHE_DIR or os.path.dirname(geojson_path), name)
+
+
+def load_outlines(geojson_path):
+    """
+    Load the outlines to draw from a geojson file, as (vertices, offsets) numpy arrays
+
+    - vertices: float64 array of (lon, lat) pairs, every outline back to back
+    - offsets: int32 array of where each outline starts in `vertices`, plus a final entry for the end
+
+    The arrays are cached in a compact .npz next to the geojson (or in CACHE_DIR), so restarts don't have to parse it again.
+    """
+    cache_path = cache_path_for(
+        geojson_path, os.path.splitext(os.path.basename(geojson_path))[0] + ".npz"
+    )
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(
+        geojson_path
+    ):
+        with np.load(cache_path) as cached:
+            if int(cached["version"]) == BASEMAP_CACHE_VERSION:
+                return cached["vertices"], cached["offsets"]
+
+    with open(geojson_path, "r") as f:
+        geo_data = json.load(f)
+
+    outlines = []
+    for feature in geo_data["features"]:
+        coords = feature["geometry"]["coordinates"]
+        if feature["geometry"]["type"] == "Polygon":
+            # every ring is drawn on its own
+            outlines.extend(coords)
+        elif feature["geometry"]["type"] == "MultiPolygon":
+            # the rings of each polygon are drawn as one outline
+            for polygon in coords:
+                outlines.append([c for ring in polygon for c in ring])
+
+    vertices = np.array(
+        [c[:2] for outline in outlines for c in outline], dtype=np.float64
+    )
+    offsets = np.cumsum([0] + [len(outline) for outline in outlines], dtype=np.int32)
+
+    try:
+        with open(cache_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                version=BASEMAP_CACHE_VERSION,
+                vertices=vertices,
+                offsets=offsets,
+            )
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as e:
+        print("Unable to cache map outlines:", e)
+
+    return vertices, offsets
+
+
+def project_outlines(vertices, offsets, width, height):
+    """
+    Project (lon, lat) vertices onto an equirectangular image of the given size.
+
+    Consecutive vertices that land on the same pixel are dropped, which simplifies the outlines for the target resolution. Returns (points, offsets) like load_outlines, with integer pixel coordinates.
+    """
+    points = np.empty(vertices.shape, dtype=np.int32)
+    points[:, 0] = (vertices[:, 0] + 180) * width / 360
+    points[:, 1] = (90 - vertices[:, 1]) * height / 180
+
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    # always keep the first vertex of each outline
+    keep[offsets[:-1]] = True
+
+    kept_before = np.concatenate(([0], np.cumsum(keep)))
+    return points[keep], kept_before[offsets]
+
+
+def render_basemap(
+    geojson_path, width, height, bg_color, outline_color, fill_color, stroke_width
+):
+    """
+    Rasterize the outlines in a geojson file into an RGB image of the world map.
+
+    The image is cached on disk next to the geojson (or in CACHE_DIR), keyed by everything that affects it, so restarts load a ready-made image.
+    """
+    stat = os.stat(geojson_path)
+    key = repr(
+        (
+            BASEMAP_CACHE_VERSION,
+            stat.st_size,
+            stat.st_mtime,
+            width,
+            height,
+            bg_color,
+            outline_color,
+            fill_color,
+            stroke_width,
+        )
+    )
+    cache_path = cache_path_for(
+        geojson_path, "basemap-%s.png" % sha256(key.encode()).hexdigest()[:16]
+    )
+
+    if os.path.exists(cache_path):
+        try:
+            with Image.open(cache_path) as image:
+                return image.convert("RGB")
+        except OSError as e:
+            print("Unable to load cached basemap:", e)
+
+    vertices, offsets = load_outlines(geojson_path)
+    points, offsets = project_outlines(vertices, offsets, width, height)
+
+    image = Image.new("RGB", (width, height), color=bg_color)
+    draw = ImageDraw.Draw(image)
+
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        outline = points[start:end].ravel().tolist()
+        if len(outline) < 4:
+            # the whole outline is within one pixel
+            draw.point(outline, fill=outline_color)
+            continue
+
+        draw.polygon(
+            outline, outline=outline_color, fill=fill_color, width=stroke_width
+        )
+
+    try:
+        image.save(cache_path + ".tmp", "PNG")
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as e:
+        print("Unable to cache basemap:", e)
+
+    return image
@@ -0,0 +1,55 @@
+import time
+from threading import Event, Lock
+
+# how long the first caller of a batch waits for others to join it, in seconds
+BATCH_WINDOW = 0.05
+
+
+class Batcher:
+    def __init__(self, run, window=BATCH_WINDOW):
+        """
+        Combines calls from widgets that refresh at about the same time into one request
+
+        The first caller with a key waits `window` seconds for others to join, then calls `run(key, items)` with every caller's item, on its own thread. run() returns a result per item, in order, or raises to fail the whole batch.
+        """
+        self.run = run
+        self.window = window
+        self.lock = Lock()
+        self.pending = {}
+
+    def submit(self, key, item):
+        """
+        Add an item to the batch for a key, and wait for it to run. Returns the item's result, or raises the batch's error.
+        """
+        with self.lock:
+            batch = self.pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.pending[key] = Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+
+        if leader:
+            time.sleep(self.window)
+            with self.lock:
+                del self.pending[key]
+            try:
+                batch.results = self.run(key, batch.items)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+
+class Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self.done = Event()
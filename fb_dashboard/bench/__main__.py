@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+from .harness import (
+    DEFAULT_RESOLUTIONS,
+    compare,
+    format_results,
+    run,
+    widget_cases,
+)
+
+if __name__ == "__main__":
+    cases = list(widget_cases("", ""))
+
+    args = argparse.ArgumentParser(
+        description="Benchmark each widget's refresh stages and the compositor against synthetic fixtures, without a network or framebuffer"
+    )
+    args.add_argument(
+        "--widgets",
+        help="Comma separated cases to run, from: %s" % ", ".join(cases),
+        default=",".join(cases),
+    )
+    args.add_argument(
+        "--resolutions",
+        help="Comma separated WIDTHxHEIGHT sizes to render the widgets at",
+        default=",".join(DEFAULT_RESOLUTIONS),
+    )
+    args.add_argument(
+        "--iterations", help="Timed refreshes per case", type=int, default=20
+    )
+    args.add_argument(
+        "--warmup",
+        help="Untimed refreshes per case before the timed ones",
+        type=int,
+        default=2,
+    )
+    args.add_argument(
+        "--no-compositor",
+        help="Skip the compositor benchmark",
+        action="store_true",
+    )
+    args.add_argument("--output", help="Write the results as JSON to this file")
+    args.add_argument(
+        "--baseline",
+        help="Compare against results written by --output, and exit with 1 if a stage regressed",
+    )
+    args.add_argument(
+        "--threshold",
+        help="How much slower a stage's median may get before it counts as a regression",
+        type=float,
+        default=0.2,
+    )
+    args = args.parse_args()
+
+    selected = [case for case in args.widgets.split(",") if case]
+    unknown = [case for case in selected if case not in cases]
+    if unknown:
+        print("Unknown widgets: %s" % ", ".join(unknown))
+        print("Known widgets: %s" % ", ".join(cases))
+        sys.exit(2)
+
+    results = run(
+        selected,
+        args.resolutions.split(","),
+        args.iterations,
+        warmup=args.warmup,
+        compositor=not args.no_compositor,
+    )
+    for line in format_results(results):
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, threshold=args.threshold)
+        for key, stage, before, after in regressions:
+            print(
+                "REGRESSION %s %s: %.2f ms -> %.2f ms (+%.0f%%)"
+                % (key, stage, before, after, (after / before - 1) * 100)
+            )
+        if regressions:
+            sys.exit(1)
+        print("No regressions against %s" % args.baseline)
@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__)) + "/fixtures"
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES_DIR, name)
+
+
+def make_photo(width=1920, height=1080):
+    """
+    A JPEG with gradients and shapes, so it decodes like a photo rather than a flat image
+    """
+    image = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge(
+        "RGB",
+        (
+            image,
+            image.transpose(Image.Transpose.ROTATE_90).resize((width, height)),
+            Image.effect_noise((width, height), 64),
+        ),
+    )
+    draw = ImageDraw.Draw(image)
+    for i in range(24):
+        x = (i * 97) % width
+        y = (i * 61) % height
+        draw.ellipse(
+            (x, y, x + width // 6, y + height // 6),
+            fill=((i * 40) % 256, (i * 90) % 256, (i * 20) % 256),
+        )
+
+    buf = BytesIO()
+    image.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_icon(size=134):
+    image = Image.new("RGB", (size, size), (90, 150, 220))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse(
+        (size // 4, size // 4, size * 3 // 4, size * 3 // 4), fill=(250, 210, 60)
+    )
+    buf = BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class FixtureServer:
+    def __init__(self):
+        """
+        Serves the fixture responses on localhost, in place of the National Weather Service API, remote images and JSON metrics. `{base}` in the fixture JSON is replaced with the server's url.
+        """
+        self.photo = make_photo()
+        self.icon = make_icon()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def make_handler(self):
+        fixtures = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes, don't wait for the delayed ack in between
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body, content_type = fixtures.respond(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def fixture_json(self, name):
+        with open(fixture_path(name)) as f:
+            return f.read().replace("{base}", self.base_url).encode()
+
+    def respond(self, path):
+        if path.startswith("/points/"):
+            return self.fixture_json("nws_points.json"), "application/geo+json"
+        if path.startswith("/gridpoints/"):
+            return self.fixture_json("nws_forecast.json"), "application/geo+json"
+        if path.startswith("/icons/"):
+            return self.icon, "image/png"
+        if path == "/photo.jpg":
+            return self.photo, "image/jpeg"
+        if path == "/metric.json":
+            return b'{"data": {"requests": 12345}}', "application/json"
+        return None, None
+
+    def start(self):
+        threading.Thread(
+            target=self.server.serve_forever, name="fixtures", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FixtureOHLCVSource:
+    """
+    Serves the synthetic bars in fixtures/ohlcv.csv for every symbol, see ohlcv.set_source()
+    """
+
+    def __init__(self):
+        import pandas as pd
+
+        self.frame = pd.read_csv(
+            fixture_path("ohlcv.csv"), index_col="Date", parse_dates=True
+        )
+
+    def download(self, symbols, interval, period=None, start=None):
+        import pandas as pd
+
+        frame = self.frame
+        if start is not None:
+            frame = frame[frame.index.tz_localize("UTC") >= pd.Timestamp(start)]
+        return {symbol: frame for symbol in symbols}
+
+
+def stub_cloudwatch(region, iterations, render_locally=False):
+    """
+    Stub the shared CloudWatch client of a region with canned responses for `iterations` refreshes, returns the activated Stubber
+
+    - render_locally: stub GetMetricData datapoints for two metrics, instead of GetMetricWidgetImage
+    """
+    from datetime import datetime as dt, timedelta, timezone
+    from botocore.stub import ANY, Stubber
+    from .. import cloudwatch
+
+    stubber = Stubber(cloudwatch.get_client(None, region))
+
+    if render_locally:
+        now = dt.now(timezone.utc)
+        timestamps = [now - timedelta(minutes=5 * i) for i in range(36, 0, -1)]
+        response = {
+            "MetricDataResults": [
+                {
+                    "Id": "m%d" % i,
+                    "Label": "Requests",
+                    "Timestamps": timestamps,
+                    "Values": [float((t * 37 + i * 11) % 100) for t in range(36)],
+                    "StatusCode": "Complete",
+                }
+                for i in range(2)
+            ]
+        }
+        expected = {
+            "MetricDataQueries": ANY,
+            "StartTime": ANY,
+            "EndTime": ANY,
+            "ScanBy": "TimestampAscending",
+        }
+        operation = "get_metric_data"
+    else:
+        chart = Image.new("RGB", (600, 300), "white")
+        ImageDraw.Draw(chart).line(
+            [(x * 10, 150 + (x * 37) % 100 - 50) for x in range(60)],
+            fill="#1f77b4",
+            width=2,
+        )
+        buf = BytesIO()
+        chart.save(buf, "PNG")
+        response = {"MetricWidgetImage": buf.getvalue()}
+        expected = {"MetricWidget": ANY, "OutputFormat": "png"}
+        operation = "get_metric_widget_image"
+
+    for _ in range(iterations):
+        stubber.add_response(operation, response, expected)
+    stubber.activate()
+    return stubber
+
+
+def copy_tle(directory):
+    """
+    Copy the synthetic TLE into a scratch directory, the satellite catalog is written next to it
+    """
+    path = os.path.join(directory, "stations.tle")
+    shutil.copy(fixture_path("stations.tle"), path)
+    return path
+
+
+def scratch_dir():
+    return tempfile.mkdtemp(prefix="fb_dashboard_bench_")
@@ -0,0 +1,402 @@
+import os
+import resource
+import shutil
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from ..framebuffer import FrameBufferBase, LinuxFrameBuffer
+from ..registry import WidgetRegistry
+from . import fixtures
+
+DEFAULT_RESOLUTIONS = ["320x240", "800x480", "1920x1080"]
+
+# the stages of a widget refresh, timed by the widget's own instrumentation (see WidgetBase.timings)
+STAGES = ["fetch", "render", "convert", "blit"]
+
+
+def widget_cases(base_url, scratch):
+    """
+    The benchmarked widgets, by case name: (widget type, config, setup). setup(iterations) runs in the worker before the widget is created, to point it at the fixtures.
+    """
+
+    # caches go to the scratch directory, so runs don't write into the source tree or warm each other up
+
+    def scratch_http_cache(iterations):
+        from .. import http_client
+
+        http_client.CACHE_DIR = os.path.join(scratch, "http")
+
+    def scratch_basemap(iterations):
+        from .. import basemap
+
+        basemap.CACHE_DIR = scratch
+
+    # a single widget has nobody to batch with, so the stores and batchers don't wait for others
+
+    def stub_stocks(iterations):
+        from .. import ohlcv
+
+        store = ohlcv.get_store()
+        store.directory = scratch
+        store.source = fixtures.FixtureOHLCVSource()
+        store.batcher.window = 0
+
+    def stub_cloudwatch(render_locally):
+        def setup(iterations):
+            from .. import cloudwatch
+
+            fixtures.stub_cloudwatch("us-east-1", iterations, render_locally)
+            cloudwatch.get_batcher(None, "us-east-1").batcher.window = 0
+
+        return setup
+
+    metric_widget = {
+        "view": "timeSeries",
+        "title": "Requests",
+        "region": "us-east-1",
+        "metrics": [
+            ["AWS/ApplicationELB", "RequestCount", "LoadBalancer", "app/a"],
+            [".", ".", ".", "app/b"],
+        ],
+        "period": 300,
+        "stat": "Sum",
+    }
+    cloudwatch_config = {
+        "widget": repr(metric_widget),
+        "aws_region": "us-east-1",
+    }
+
+    return {
+        "Clock": ("Clock", {}, None),
+        "Text": ("Text", {"text": "Hello, dashboard", "size": "h / 6"}, None),
+        "Image": (
+            "Image",
+            {"path": base_url + "/photo.jpg", "http_cache": "False"},
+            scratch_http_cache,
+        ),
+        "Metric": (
+            "Metric",
+            {
+                "url": base_url + "/metric.json",
+                "json_path": "data.requests",
+                "label": "Requests",
+                "http_cache": "False",
+            },
+            scratch_http_cache,
+        ),
+        "Weather": (
+            "Weather",
+            {
+                "latitude": "40.7128",
+                "longitude": "-74.006",
+                "api_url": base_url,
+                "http_cache": "False",
+            },
+            scratch_http_cache,
+        ),
+        "StockMarketCandlestick": (
+            "StockMarketCandlestick",
+            {"symbol": "BENCH", "time_period": "3mo"},
+            stub_stocks,
+        ),
+        "CloudWatchMetricImage": (
+            "CloudWatchMetricImage",
+            cloudwatch_config,
+            stub_cloudwatch(False),
+        ),
+        "CloudWatchMetricData": (
+            "CloudWatchMetricImage",
+            {**cloudwatch_config, "render_locally": "True"},
+            stub_cloudwatch(True),
+        ),
+        "SatelliteMap": (
+            "SatelliteMap",
+            {"tle_url": os.path.join(scratch, "stations.tle")},
+            scratch_basemap,
+        ),
+    }
+
+
+class BenchFrameBuffer(FrameBufferBase):
+    def __init__(self, width, height, bits_per_pixel=32):
+        """
+        A framebuffer in memory, swapping into a plain bytearray the way LinuxFrameBuffer copies into the mmap without page flipping
+        """
+        super().__init__(width, height, bits_per_pixel, export_filename=None)
+        self.fb = bytearray(len(self.virtual_buffer))
+
+    def swap_buffers(self, rects=None):
+        if rects is not None and not rects:
+            return
+        LinuxFrameBuffer.copy_rects(self, self.virtual_buffer, self.fb, rects)
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def summarize(samples):
+    """
+    Median and 95th percentile of a list of seconds, in milliseconds
+    """
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))]
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": p95 * 1000,
+    }
+
+
+def peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def refresh_once(widget, fb):
+    """
+    Refresh and blit a widget, forcing it to render even if its inputs are unchanged. Returns the seconds spent in each stage.
+    """
+    widget.input_hash = None
+    widget.frame_hash = None
+    before = {stage: widget.timings[stage].total for stage in STAGES}
+
+    # bookkeeping of a refresh queued by refresh_in_bg()
+    widget.refreshes_in_flight += 1
+    widget._refresh_and_notify()
+    if widget.last_refresh is None:
+        raise RuntimeError("%s failed to refresh" % widget.name)
+    widget.write_into_fb(fb)
+
+    return {stage: widget.timings[stage].total - before[stage] for stage in STAGES}
+
+
+def run_widget_case(name, base_url, resolution, iterations, warmup):
+    """
+    Benchmark one widget at one resolution, in a fresh worker process so its peak RSS is its own
+    """
+    scratch = fixtures.scratch_dir()
+    try:
+        fixtures.copy_tle(scratch)
+        kind, config, setup = widget_cases(base_url, scratch)[name]
+        width, height = parse_resolution(resolution)
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            if setup:
+                setup(iterations + warmup)
+
+            start = time.perf_counter()
+            widget_class = WidgetRegistry().get(kind)
+            widget = widget_class(0, 0, width, height, dict(config))
+            widget.name = name
+            init_seconds = time.perf_counter() - start
+
+            fb = BenchFrameBuffer(width, height)
+            widget.pixel_format = fb.pixel_format
+
+            samples = {stage: [] for stage in STAGES + ["total"]}
+            for i in range(warmup + iterations):
+                start = time.perf_counter()
+                stages = refresh_once(widget, fb)
+                total = time.perf_counter() - start
+                if i < warmup:
+                    continue
+                for stage, seconds in stages.items():
+                    samples[stage].append(seconds)
+                samples["total"].append(total)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        "case": name,
+        "resolution": resolution,
+        "init_ms": init_seconds * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+    }
+
+
+def run_compositor_case(base_url, resolution, iterations, warmup):
+    """
+    Benchmark compositing a 2x2 dashboard of a clock, text, an image and a metric, when all of them changed and when only the clock did
+    """
+    from ..compositor import Compositor
+    from .. import http_client
+
+    scratch = fixtures.scratch_dir()
+    http_client.CACHE_DIR = os.path.join(scratch, "http")
+    width, height = parse_resolution(resolution)
+    fb = BenchFrameBuffer(width, height)
+    registry = WidgetRegistry()
+
+    # a 2x2 grid
+    layout = [
+        ("Clock", {}),
+        ("Text", {"text": "Hello, dashboard", "size": "h / 6"}),
+        ("Image", {"path": base_url + "/photo.jpg", "http_cache": "False"}),
+        (
+            "Metric",
+            {
+                "url": base_url + "/metric.json",
+                "json_path": "data.requests",
+                "http_cache": "False",
+            },
+        ),
+    ]
+    widgets = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        try:
+            for index, (kind, config) in enumerate(layout):
+                widget = registry.get(kind)(
+                    (index % 2) * width // 2,
+                    (index // 2) * height // 2,
+                    width // 2,
+                    height // 2,
+                    config,
+                )
+                widget.name = kind
+                widget.pixel_format = fb.pixel_format
+                widgets.append(widget)
+                widget.refreshes_in_flight += 1
+                widget._refresh_and_notify()
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    compositor = Compositor(fb, widgets)
+    compositor.compose()
+
+    def frame(changed):
+        for widget in changed:
+            widget.generation += 1
+        start = time.perf_counter()
+        compositor.compose()
+        return time.perf_counter() - start
+
+    all_dirty = [frame(widgets) for _ in range(warmup + iterations)][warmup:]
+    clock_only = [frame(widgets[:1]) for _ in range(warmup + iterations)][warmup:]
+
+    return {
+        "case": "Compositor",
+        "resolution": resolution,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {
+            "all_dirty": summarize(all_dirty),
+            "clock_only": summarize(clock_only),
+        },
+        "fps": 1 / statistics.median(all_dirty),
+    }
+
+
+def in_worker(fn, *args):
+    """
+    Run fn in a freshly spawned process, so it imports and allocates from scratch
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def run(cases, resolutions, iterations, warmup=2, compositor=True):
+    """
+    Run every case at every resolution against a fixture server, returns a list of results
+    """
+    server = fixtures.FixtureServer().start()
+    results = []
+    try:
+        for resolution in resolutions:
+            for name in cases:
+                results.append(
+                    in_worker(
+                        run_widget_case,
+                        name,
+                        server.base_url,
+                        resolution,
+                        iterations,
+                        warmup,
+                    )
+                )
+            if compositor:
+                results.append(
+                    in_worker(
+                        run_compositor_case,
+                        server.base_url,
+                        resolution,
+                        iterations,
+                        warmup,
+                    )
+                )
+    finally:
+        server.stop()
+    return results
+
+
+def result_key(result):
+    return "%s@%s" % (result["case"], result["resolution"])
+
+
+def compare(results, baseline, threshold=0.2, min_delta_ms=1.0):
+    """
+    Regressions against a baseline, as (key, stage, baseline ms, current ms). A stage regressed when its median is more than `threshold` slower, and by more than `min_delta_ms` so sub-millisecond noise doesn't count.
+    """
+    previous = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for stage, summary in result["stages"].items():
+            if stage not in old["stages"]:
+                continue
+            before = old["stages"][stage]["median_ms"]
+            after = summary["median_ms"]
+            if after > before * (1 + threshold) and after - before > min_delta_ms:
+                regressions.append((result_key(result), stage, before, after))
+    return regressions
+
+
+def format_results(results):
+    """
+    The results as a table of printable lines
+    """
+    lines = [
+        "%-34s %9s %9s %9s %9s %9s %9s %8s"
+        % ("case", "total", "p95", "fetch", "render", "convert", "blit", "rss [MB]")
+    ]
+    for result in results:
+        stages = result["stages"]
+        if result["case"] == "Compositor":
+            lines.append(
+                "%-34s %9.2f %9.2f %39s %8.1f"
+                % (
+                    result_key(result) + " (all dirty)",
+                    stages["all_dirty"]["median_ms"],
+                    stages["all_dirty"]["p95_ms"],
+                    "%.0f fps" % result["fps"],
+                    result["peak_rss_mb"],
+                )
+            )
+            lines.append(
+                "%-34s %9.2f %9.2f"
+                % (
+                    result_key(result) + " (clock only)",
+                    stages["clock_only"]["median_ms"],
+                    stages["clock_only"]["p95_ms"],
+                )
+            )
+            continue
+
+        lines.append(
+            "%-34s %9.2f %9.2f %9.2f %9.2f %9.2f %9.2f %8.1f"
+            % (
+                result_key(result),
+                stages["total"]["median_ms"],
+                stages["total"]["p95_ms"],
+                *(stages[stage]["median_ms"] for stage in STAGES),
+                result["peak_rss_mb"],
+            )
+        )
+    lines.append(
+        "times are medians in ms, --output also has the p95 of every stage and the widget init time"
+    )
+    return lines
@@ -0,0 +1,196 @@
+import re
+from datetime import datetime as dt, timedelta, timezone
+from threading import Lock
+import boto3
+from botocore.config import Config
+from .batching import BATCH_WINDOW, Batcher
+from .http_client import DEFAULT_TIMEOUT
+
+# boto3 stays blocking, but shouldn't hold a refresh thread for longer than an http fetch would
+BOTO_CONFIG = Config(connect_timeout=DEFAULT_TIMEOUT, read_timeout=DEFAULT_TIMEOUT)
+
+# most queries a single GetMetricData call accepts
+MAX_QUERIES_PER_CALL = 500
+
+_clients = {}
+_batchers = {}
+_lock = Lock()
+
+DURATION_RE = re.compile(
+    r"^(?P<sign>-?)P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+
+
+def get_client(profile=None, region=None):
+    """
+    The CloudWatch client for an AWS profile and region, created once and shared by all widgets. boto3 clients are thread safe, sessions are not.
+
+    To stub it, wrap the client this returns in a botocore.stub.Stubber before the widgets refresh.
+    """
+    with _lock:
+        client = _clients.get((profile, region))
+        if client is None:
+            if profile or region:
+                session = boto3.session.Session(
+                    profile_name=profile, region_name=region
+                )
+                client = session.client("cloudwatch", config=BOTO_CONFIG)
+            else:
+                client = boto3.client("cloudwatch", config=BOTO_CONFIG)
+            _clients[(profile, region)] = client
+        return client
+
+
+def get_batcher(profile=None, region=None):
+    """
+    The MetricDataBatcher for an AWS profile and region, shared by all widgets
+    """
+    client = get_client(profile, region)
+    with _lock:
+        batcher = _batchers.get((profile, region))
+        if batcher is None:
+            batcher = _batchers[(profile, region)] = MetricDataBatcher(client)
+        return batcher
+
+
+def parse_time(value, now):
+    """
+    Parse a metric widget's `start` or `end`, either an ISO 8601 duration relative to now like `-PT3H`, or a timestamp
+    """
+    match = DURATION_RE.match(value)
+    if match:
+        delta = timedelta(
+            days=int(match["days"] or 0),
+            hours=int(match["hours"] or 0),
+            minutes=int(match["minutes"] or 0),
+            seconds=int(match["seconds"] or 0),
+        )
+        return now - delta if match["sign"] else now + delta
+
+    timestamp = dt.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def metric_queries(widget):
+    """
+    Turn the `metrics` of a metric widget definition into GetMetricData queries, one per metric
+
+    Each metric is `[namespace, metric name, dimension name, dimension value, ..., {options}]`, where `.` repeats the value at the same position in the previous metric. Metric math expressions are not supported.
+    """
+    queries = []
+    previous = []
+    for metric in widget["metrics"]:
+        options = {}
+        if metric and isinstance(metric[-1], dict):
+            options = metric[-1]
+            metric = metric[:-1]
+
+        if "expression" in options or "..." in metric:
+            raise ValueError(
+                "Metric math and `...` are not supported when rendering locally"
+            )
+
+        metric = [
+            previous[i] if value == "." else value for i, value in enumerate(metric)
+        ]
+        previous = metric
+
+        namespace, name, dimensions = metric[0], metric[1], metric[2:]
+        queries.append(
+            {
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": namespace,
+                        "MetricName": name,
+                        "Dimensions": [
+                            {"Name": dimensions[i], "Value": dimensions[i + 1]}
+                            for i in range(0, len(dimensions), 2)
+                        ],
+                    },
+                    "Period": int(options.get("period", widget.get("period", 300))),
+                    "Stat": options.get("stat", widget.get("stat", "Average")),
+                },
+                "Label": options.get("label", name),
+            }
+        )
+    return queries
+
+
+class MetricDataBatcher:
+    def __init__(self, client, window=BATCH_WINDOW):
+        """
+        Combines the GetMetricData queries of widgets that refresh at about the same time into as few calls as possible
+
+        The first widget to ask for a time range waits `window` seconds for others to join, then makes the calls for all of them.
+        """
+        self.client = client
+        self.batcher = Batcher(self.run, window)
+        self.lock = Lock()
+
+        # counters, for checking how well refreshes are batched
+        self.calls = 0
+        self.queries = 0
+
+    def get_metric_data(self, queries, start, end):
+        """
+        Run GetMetricData queries for a time range, from a widget's refresh thread. Returns a (label, timestamps, values) tuple per query, oldest first.
+        """
+        return self.batcher.submit((start, end), queries)
+
+    def run(self, key, query_lists):
+        """
+        Make the calls for every widget's queries in a batch, see Batcher
+        """
+        start, end = key
+        batch = MetricDataBatch()
+        ids = [batch.add(queries) for queries in query_lists]
+
+        for i in range(0, len(batch.queries), MAX_QUERIES_PER_CALL):
+            self.query(batch, batch.queries[i : i + MAX_QUERIES_PER_CALL], start, end)
+
+        return [[batch.results[query_id] for query_id in group] for group in ids]
+
+    def query(self, batch, queries, start, end):
+        kwargs = {
+            "MetricDataQueries": queries,
+            "StartTime": start,
+            "EndTime": end,
+            "ScanBy": "TimestampAscending",
+        }
+        while True:
+            response = self.client.get_metric_data(**kwargs)
+            with self.lock:
+                self.calls += 1
+                self.queries += len(queries)
+
+            for result in response["MetricDataResults"]:
+                label, timestamps, values = batch.results[result["Id"]]
+                batch.results[result["Id"]] = (
+                    label,
+                    timestamps + list(result["Timestamps"]),
+                    values + list(result["Values"]),
+                )
+
+            if not response.get("NextToken"):
+                return
+            kwargs["NextToken"] = response["NextToken"]
+
+
+class MetricDataBatch:
+    def __init__(self):
+        self.queries = []
+        self.results = {}
+
+    def add(self, queries):
+        """
+        Add a widget's queries under ids that are unique in the batch, returns the ids
+        """
+        ids = []
+        for query in queries:
+            query_id = "m%d" % len(self.queries)
+            self.queries.append({**query, "Id": query_id, "ReturnData": True})
+            self.results[query_id] = (query.get("Label"), [], [])
+            ids.append(query_id)
+        return ids
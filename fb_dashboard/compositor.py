@@ -0,0 +1,82 @@
+import time
+from .metrics import Timing
+
+
+def clip_rect(rect, width, height):
+    """
+    Clip an (x, y, width, height) rect against a (width, height) area, returns None if nothing is left
+    """
+    x, y, w, h = rect
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, width), min(y + h, height)
+
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def rects_intersect(a, b):
+    return (
+        a[0] < b[0] + b[2]
+        and b[0] < a[0] + a[2]
+        and a[1] < b[1] + b[3]
+        and b[1] < a[1] + a[3]
+    )
+
+
+class Compositor:
+    def __init__(self, fb, widgets):
+        """
+        Composites widgets into the framebuffer, only redrawing the regions that changed since the last frame.
+
+        Each widget bumps its `generation` when it refreshes. A widget is redrawn when its generation differs from the one we last drew, or when it overlaps a region redrawn earlier in the same frame (later widgets are drawn on top).
+        """
+        self.fb = fb
+        self.widgets = widgets
+        self.drawn_generations = {}
+        self.has_composited = False
+
+        # how long compose() took, for frames that changed something
+        self.frame_time = Timing()
+
+    def compose(self):
+        """
+        Draw changed widgets into the virtual buffer and copy the dirty regions into the framebuffer.
+
+        Returns the list of dirty rects, which is empty when nothing changed.
+        """
+        start = time.perf_counter()
+        dirty = []
+
+        for widget in self.widgets:
+            rect = clip_rect(
+                (widget.x, widget.y, widget.width, widget.height),
+                self.fb.fb_width,
+                self.fb.fb_height,
+            )
+            if rect is None:
+                continue
+
+            # read the generation before drawing, a refresh landing mid-write just gets drawn again next frame
+            generation = widget.generation
+            if self.drawn_generations.get(id(widget)) == generation and not any(
+                rects_intersect(rect, other) for other in dirty
+            ):
+                continue
+
+            widget.write_into_fb(self.fb)
+            self.drawn_generations[id(widget)] = generation
+            dirty.append(rect)
+
+        if not self.has_composited:
+            # first frame, push the whole buffer so the screen starts out clean
+            self.fb.swap_buffers()
+            self.has_composited = True
+        elif dirty:
+            self.fb.swap_buffers(dirty)
+        else:
+            return dirty
+
+        self.frame_time.add(time.perf_counter() - start)
+        return dirty
@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+import atexit
+import os
+import traceback
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class RefreshExecutor:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        A bounded thread pool shared by all widget refreshes, so a dashboard doesn't spawn a new thread for every refresh.
+
+        Keeps counters of queued, running, completed and failed refreshes, see stats().
+        """
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="refresh"
+        )
+
+        self.lock = Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        return self.pool.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+
+        try:
+            return fn(*args)
+        except Exception:
+            # futures swallow exceptions, print them like a plain thread would
+            traceback.print_exc()
+            with self.lock:
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+
+    def record_failure(self):
+        """
+        Count a refresh that failed before it reached the pool, like a widget's fetch() on the event loop
+        """
+        with self.lock:
+            self.completed += 1
+            self.failed += 1
+
+    def stats(self):
+        """
+        Snapshot of the pool's counters
+        """
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+
+_executor = None
+_executor_lock = Lock()
+
+
+def configure_executor(max_workers):
+    """
+    Set the size of the shared refresh pool, must be called before any widget refreshes
+    """
+    global _executor
+    with _executor_lock:
+        _executor = RefreshExecutor(max_workers)
+    return _executor
+
+
+def get_executor():
+    """
+    The shared refresh pool, created with the default size on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = RefreshExecutor()
+        return _executor
+
+
+_process_pool_size = None
+_shared_memory = []
+
+# single worker pools, by index, and the worker each widget is pinned to
+_process_pools = {}
+_process_pool_assignments = {}
+
+# widgets rendered by this worker process, keyed by the parent widget
+_worker_widgets = {}
+
+
+def configure_process_pool(max_workers):
+    """
+    Set the number of worker processes used by widgets with `executor = "process"`
+    """
+    global _process_pool_size
+    _process_pool_size = max_workers
+
+
+def get_process_pool(key):
+    """
+    The worker process that renders the widget with this key. Each widget is pinned to one worker, assigned round robin, so every refresh runs on the same copy of the widget and its state carries over. Workers are only started once a widget needs them.
+    """
+    with _executor_lock:
+        index = _process_pool_assignments.get(key)
+        if index is None:
+            index = len(_process_pool_assignments) % (
+                _process_pool_size or os.cpu_count()
+            )
+            _process_pool_assignments[key] = index
+
+        if index not in _process_pools:
+            # spawn, since forking a process with running threads is unsafe
+            _process_pools[index] = ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context("spawn")
+            )
+        return _process_pools[index]
+
+
+def create_shared_memory(size):
+    """
+    Create a shared memory block that worker processes write rendered frames into, unlinked at exit
+    """
+    shared_memory = SharedMemory(create=True, size=size)
+    _shared_memory.append(shared_memory)
+    return shared_memory
+
+
+@atexit.register
+def _unlink_shared_memory():
+    for shared_memory in _shared_memory:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def render_in_process(key, widget_class, init_args, pixel_format, shared_memory_name):
+    """
+    Runs in a worker process. Refreshes this process's copy of the widget, and writes the rendered frame into shared memory instead of pickling it back.
+
+    The copy is kept between refreshes, so state like downloaded data and cached images survives. Returns (length, skipped, changed): the frame's size in bytes, whether the refresh skipped rendering because its inputs were unchanged, and whether the pixels changed.
+    """
+    widget = _worker_widgets.get(key)
+    if widget is None:
+        widget = widget_class(*init_args)
+        _worker_widgets[key] = widget
+
+    skipped_renders = widget.skipped_renders
+    generation = widget.generation
+
+    widget.pixel_format = pixel_format
+    widget.refresh()
+
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        shared_memory.buf[: len(widget.bytes)] = widget.bytes
+    finally:
+        shared_memory.close()
+
+    return (
+        len(widget.bytes),
+        widget.skipped_renders > skipped_renders,
+        widget.generation > generation,
+    )
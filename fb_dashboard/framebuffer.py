@@ -1,16 +1,25 @@
 import os
-from io import BytesIO
 import mmap
-from PIL import Image
+import fcntl
+import struct
+from .pixel_format import PixelFormat
 
 
 class FrameBufferBase:
     def __init__(
-        self, width, height, bits_per_pixel=32, export_filename="framebuffer.png"
+        self,
+        width,
+        height,
+        bits_per_pixel=32,
+        export_filename="framebuffer.png",
+        pixel_format=None,
     ):
         self.fb_width = width
         self.fb_height = height
         self.fb_bits_per_pixel = bits_per_pixel
+        self.pixel_format = pixel_format or PixelFormat.from_bits_per_pixel(
+            bits_per_pixel
+        )
         self.export_filename = export_filename
 
         # setup a buffer to draw to
@@ -20,22 +29,17 @@ class FrameBufferBase:
         """
         Create a virtual buffer to store the image data.
         We write to this buffer and then swap it with the actual framebuffer, to avoid flickering and tearing while drawing, since drawing pixels directly to the framebuffer is slow.
+
+        The buffer is a preallocated bytearray exposed as a memoryview, so writes and swaps are slice assignments with no intermediate copies.
         """
-        buf = BytesIO()
         num_pixels = self.fb_width * self.fb_height
 
-        if self.fb_bits_per_pixel // 8 == 4:
-            # 32-bit color, 8 bits per channel
-            buf.write(b"\x00\x00\x00\xff" * num_pixels)
-        elif self.fb_bits_per_pixel // 8 == 3:
-            # 24-bit color, 8 bits per channel
-            buf.write(b"\x00\x00\x00" * num_pixels)
-        else:
-            raise ValueError("Unsupported bits per pixel")
-
-        buf.seek(0)
+        # start out opaque black
+        buf = bytearray(self.pixel_format.pack_color((0, 0, 0, 255))) * num_pixels
 
-        self.virtual_buffer = buf
+        self.bytes_per_pixel = self.pixel_format.bytes_per_pixel
+        self.stride = self.fb_width * self.bytes_per_pixel
+        self.virtual_buffer = memoryview(buf)
 
     def set_pixel(self, x, y, r, g, b, a):
         """
@@ -44,81 +48,238 @@ class FrameBufferBase:
         if x < 0 or x >= self.fb_width or y < 0 or y >= self.fb_height:
             return
 
-        self.virtual_buffer.seek((y * self.fb_width + x) * self.fb_bits_per_pixel // 8)
-        self.virtual_buffer.write(b.to_bytes(1, byteorder="little"))
-        self.virtual_buffer.write(g.to_bytes(1, byteorder="little"))
-        self.virtual_buffer.write(r.to_bytes(1, byteorder="little"))
-        self.virtual_buffer.write(a.to_bytes(1, byteorder="little"))
+        offset = y * self.stride + x * self.bytes_per_pixel
+        self.virtual_buffer[offset : offset + self.bytes_per_pixel] = (
+            self.pixel_format.pack_color((r, g, b, a))
+        )
 
     def write_line(self, x, y, bytes):
         """
         write a line of pixels to the virtual buffer
         """
-        self.virtual_buffer.seek((y * self.fb_width + x) * self.fb_bits_per_pixel // 8)
-        self.virtual_buffer.write(bytes)
+        offset = y * self.stride + x * self.bytes_per_pixel
+        # the buffer has a fixed size, drop anything past its end
+        length = max(min(len(bytes), len(self.virtual_buffer) - offset), 0)
+        self.virtual_buffer[offset : offset + length] = memoryview(bytes)[:length]
+
+    def blit(self, x, y, width, height, buffer, stride=None):
+        """
+        write a rectangle of pixels to the virtual buffer, clipped against the framebuffer bounds
+
+        - buffer: any bytes-like object holding `height` rows of pixels, in the framebuffer's format
+        - stride: length of a row in `buffer`, in bytes. Defaults to `width * bytes_per_pixel`
+        """
+        if stride is None:
+            stride = width * self.bytes_per_pixel
+
+        # clip against the framebuffer, so an overflowing widget doesn't wrap into the next row
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.fb_width), min(y + height, self.fb_height)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        row_length = (x1 - x0) * self.bytes_per_pixel
+        rows = y1 - y0
+
+        src = memoryview(buffer).cast("B")
+        src_offset = (y0 - y) * stride + (x0 - x) * self.bytes_per_pixel
+        offset = y0 * self.stride + x0 * self.bytes_per_pixel
+
+        if row_length == stride == self.stride:
+            # full-width rect, the rows are contiguous in both buffers
+            self.virtual_buffer[offset : offset + row_length * rows] = src[
+                src_offset : src_offset + row_length * rows
+            ]
+            return
+
+        for row in range(rows):
+            self.virtual_buffer[offset : offset + row_length] = src[
+                src_offset : src_offset + row_length
+            ]
+            offset += self.stride
+            src_offset += stride
 
     def export_png(self, path):
         """
         Export the virtual buffer as a PNG file
         Mainly for debugging purposes, running without a framebuffer on a non-linux system or in a container
         """
-        img = Image.frombytes(
-            "RGBA",
-            (self.fb_width, self.fb_height),
-            self.virtual_buffer.getvalue(),
-            "raw",
-            "BGRA",
+        img = self.pixel_format.to_image(
+            self.virtual_buffer, self.fb_width, self.fb_height
         )
         img.save(path, "PNG")
 
-    def swap_buffers(self):
+    def swap_buffers(self, rects=None):
         """
         'swap' the virtual buffer with the actual framebuffer
 
         bulk write the virtual buffer to the framebuffer, so that the screen updates in one go
+        - rects: optional list of (x, y, width, height) regions that changed. If omitted, the whole frame is written.
         """
+        if rects is not None and not rects:
+            return
+
         if self.export_filename:
             self.export_png(self.export_filename)
 
 
+# ioctls from linux/fb.h
+FBIOGET_VSCREENINFO = 0x4600
+FBIOPAN_DISPLAY = 0x4606
+
+# struct fb_var_screeninfo is 40 __u32 fields
+FB_VAR_SCREENINFO = struct.Struct("40I")
+FB_VAR_XRES = 0
+FB_VAR_YRES = 1
+FB_VAR_YOFFSET = 5
+
+
 class LinuxFrameBuffer(FrameBufferBase):
-    def __init__(self, fb_name):
+    def __init__(
+        self,
+        fb_name,
+        page_flip=True,
+        device_path=None,
+        sysfs_path=None,
+        ioctl=fcntl.ioctl,
+    ):
+        """
+        A linux framebuffer device, e.g. /dev/fb0
+
+        When the kernel exposes a virtual height of at least twice the visible height, widgets are drawn straight into the hidden half of the mmap, and swap_buffers pans the display to it with FBIOPAN_DISPLAY. Otherwise, we fall back to drawing into a virtual buffer and copying it into the visible framebuffer.
+
+        - page_flip: set to False to always use the copy path
+        - device_path: path to the framebuffer device, defaults to /dev/<fb_name>. May be a plain file for testing, in which case the ioctls fail and the copy path is used.
+        - sysfs_path: path to the framebuffer's sysfs directory, defaults to /sys/class/graphics/<fb_name>
+        - ioctl: called like fcntl.ioctl for FBIOGET_VSCREENINFO and FBIOPAN_DISPLAY, replaceable to exercise page flipping without a device
+        """
         self.fb_name = fb_name
+        self.ioctl = ioctl
+        self.fbpath = device_path or "/dev/" + self.fb_name
+        sysfs_path = sysfs_path or "/sys/class/graphics/" + self.fb_name
 
         # get fb resolution
-        [fb_w, fb_h] = (
-            open("/sys/class/graphics/fb0/virtual_size", "r").read().strip().split(",")
-        )
+        with open(os.path.join(sysfs_path, "virtual_size"), "r") as f:
+            [fb_w, fb_h] = f.read().strip().split(",")
         self.fb_width = int(fb_w)
         self.fb_height = int(fb_h)
 
         # get bits per pixel
-        self.fb_bits_per_pixel = int(
-            open("/sys/class/graphics/fb0/bits_per_pixel", "r").read()
-        )
+        with open(os.path.join(sysfs_path, "bits_per_pixel"), "r") as f:
+            self.fb_bits_per_pixel = int(f.read())
 
-        # save the screen resolution
-        self.fbpath = "/dev/" + self.fb_name
         self.fbdev = os.open(self.fbpath, os.O_RDWR)
 
-        # use mmap to map the framebuffer to memory
-        num_bits = self.fb_width * self.fb_height * self.fb_bits_per_pixel
+        # the visible resolution is only available through the ioctl
+        self.var_screeninfo = self.read_var_screeninfo()
+        if self.var_screeninfo:
+            visible_height = self.var_screeninfo[FB_VAR_YRES]
+        else:
+            visible_height = self.fb_height
+
+        self.page_flip = (
+            page_flip
+            and self.var_screeninfo is not None
+            and self.var_screeninfo[FB_VAR_XRES] == self.fb_width
+            and self.fb_height >= 2 * visible_height
+            and self.pan_display(0)
+        )
+        self.fb_height = visible_height
+
+        # the channel layout is only available through the ioctl too
+        if self.var_screeninfo:
+            self.pixel_format = PixelFormat.from_var_screeninfo(self.var_screeninfo)
+        else:
+            self.pixel_format = PixelFormat.from_bits_per_pixel(self.fb_bits_per_pixel)
+
+        # use mmap to map the framebuffer to memory, both pages when flipping
+        page_size = self.fb_width * self.fb_height * self.fb_bits_per_pixel // 8
         self.fb = mmap.mmap(
             self.fbdev,
-            num_bits // 8,
+            page_size * 2 if self.page_flip else page_size,
             mmap.MAP_SHARED,
             mmap.PROT_WRITE | mmap.PROT_READ,
             offset=0,
         )
 
+        # page currently being scanned out, we draw into the other one
+        self.front_page = 0
+
         # setup a buffer to draw to
         self.make_buffer()
 
-    def swap_buffers(self):
+    def read_var_screeninfo(self):
+        """
+        Read the variable screen info with FBIOGET_VSCREENINFO, returns None if the device doesn't support it
+        """
+        try:
+            raw = self.ioctl(
+                self.fbdev, FBIOGET_VSCREENINFO, bytes(FB_VAR_SCREENINFO.size)
+            )
+        except OSError:
+            return None
+
+        return list(FB_VAR_SCREENINFO.unpack(raw))
+
+    def pan_display(self, yoffset):
+        """
+        Pan the visible area to `yoffset` rows into the virtual framebuffer, returns False if panning is not supported
+        """
+        var = list(self.var_screeninfo)
+        var[FB_VAR_YOFFSET] = yoffset
+
+        try:
+            self.ioctl(self.fbdev, FBIOPAN_DISPLAY, FB_VAR_SCREENINFO.pack(*var))
+        except OSError:
+            return False
+
+        return True
+
+    def page(self, index):
+        page_size = self.fb_height * self.fb_width * self.fb_bits_per_pixel // 8
+        return memoryview(self.fb)[index * page_size : (index + 1) * page_size]
+
+    def make_buffer(self):
+        """
+        When page flipping, the virtual buffer is the hidden page of the real framebuffer, so nothing is copied on swap
+        """
+        super().make_buffer()
+
+        if self.page_flip:
+            # clear both pages
+            self.page(0)[:] = self.virtual_buffer
+            self.page(1)[:] = self.virtual_buffer
+            self.virtual_buffer = self.page(1 - self.front_page)
+
+    def swap_buffers(self, rects=None):
         """
         'swap' the virtual buffer with the actual framebuffer
 
         bulk write the virtual buffer to the framebuffer, so that the screen updates in one go
+        - rects: optional list of (x, y, width, height) regions that changed. Only those rows are copied into the framebuffer.
         """
-        self.fb.seek(0)
-        self.fb.write(self.virtual_buffer.getvalue())
+        if rects is not None and not rects:
+            return
+
+        if self.page_flip:
+            self.front_page = 1 - self.front_page
+            self.pan_display(self.front_page * self.fb_height)
+
+            # bring the new back page up to date with what's on screen, so the next frame only has to draw what changes
+            back_page = self.page(1 - self.front_page)
+            self.copy_rects(self.page(self.front_page), back_page, rects)
+            self.virtual_buffer = back_page
+        else:
+            self.copy_rects(self.virtual_buffer, self.fb, rects)
+
+    def copy_rects(self, src, dst, rects=None):
+        if rects is None:
+            dst[: len(src)] = src
+            return
+
+        for x, y, width, height in rects:
+            row_length = width * self.bytes_per_pixel
+            offset = y * self.stride + x * self.bytes_per_pixel
+            for row in range(height):
+                dst[offset : offset + row_length] = src[offset : offset + row_length]
+                offset += self.stride
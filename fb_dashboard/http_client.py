@@ -0,0 +1,376 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from hashlib import blake2b
+from tempfile import SpooledTemporaryFile
+import aiohttp
+from multidict import CIMultiDict
+
+DEFAULT_TIMEOUT = 10
+
+# downloads larger than this are spooled to disk instead of memory, in bytes
+SPOOL_MAX_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# where fetch() keeps cached responses, so the last known content survives a restart
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "fb_dashboard",
+    "http",
+)
+
+# a cache_ttl for responses that never change
+FOREVER = float("inf")
+
+# connections open at once, in total and to a single host. Keep-alive connections are reused between refreshes.
+MAX_CONNECTIONS = 32
+MAX_CONNECTIONS_PER_HOST = 4
+
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+
+# cache keys being revalidated, so a url is only requested once at a time
+_revalidations = {}
+
+
+def get_loop():
+    """
+    The event loop all network fetches run on, started in a background thread on first use
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="http", daemon=True).start()
+        return _loop
+
+
+def get_session():
+    """
+    The aiohttp session shared by all widgets, only call this on the event loop
+    """
+    global _session
+    if _session is None:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST
+            )
+        )
+    return _session
+
+
+@atexit.register
+def _close_session():
+    if _session is not None and _loop is not None and _loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_session.close(), _loop).result(1)
+        except Exception:
+            pass
+
+
+def submit(coro):
+    """
+    Schedule a coroutine on the event loop from any thread, returns a concurrent.futures.Future
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro):
+    """
+    Run a coroutine on the event loop from a widget's thread, and wait for its result. The coroutine is cancelled if the waiting thread gives up.
+    """
+    future = submit(coro)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def basic_auth(username, password):
+    return aiohttp.BasicAuth(username, password)
+
+
+class DigestAuth(aiohttp.DigestAuthMiddleware):
+    def __init__(self, login, password):
+        """
+        aiohttp's digest middleware, with the login kept for cache keys like BasicAuth.login
+        """
+        super().__init__(login, password)
+        self.login = login
+
+
+def digest_auth(username, password):
+    return DigestAuth(username, password)
+
+
+class Response:
+    def __init__(self, status_code, reason, headers):
+        """
+        The parts of a response that widgets use, named like requests.Response
+
+        - content: the body, unless it was spooled
+        - body, digest: the spooled body as a rewound file, and its blake2b digest, see fetch(spool=True)
+        - stale: True if this is a cached response past its ttl, see fetch(max_stale=...)
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = b""
+        self.body = None
+        self.digest = None
+        self.stale = False
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class CacheEntry:
+    def __init__(self, key, status_code, reason, headers, digest, stored):
+        """
+        A response in the disk cache. The body is kept in its own file next to the metadata, so spooled downloads are never read into memory.
+        """
+        self.key = key
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.digest = digest
+        self.stored = stored
+
+    @property
+    def path(self):
+        return os.path.join(CACHE_DIR, self.key)
+
+    @classmethod
+    def load(cls, key):
+        try:
+            with open(os.path.join(CACHE_DIR, key + ".json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return cls(
+            key,
+            meta["status_code"],
+            meta["reason"],
+            CIMultiDict(meta["headers"]),
+            bytes.fromhex(meta["digest"]),
+            meta["stored"],
+        )
+
+    def save(self):
+        """
+        Write the metadata, after the body has been moved to self.path + ".body"
+        """
+        meta = {
+            "status_code": self.status_code,
+            "reason": self.reason,
+            "headers": list(self.headers.items()),
+            "digest": self.digest.hex(),
+            "stored": self.stored,
+        }
+        with open(self.path + ".json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def age(self):
+        return time.time() - self.stored
+
+    def response(self, spool):
+        result = Response(self.status_code, self.reason, self.headers.copy())
+        result.digest = self.digest
+        if spool:
+            result.body = open(self.path + ".body", "rb")
+        else:
+            with open(self.path + ".body", "rb") as f:
+                result.content = f.read()
+        return result
+
+
+def _request(url, headers, auth, timeout):
+    kwargs = {}
+    if isinstance(auth, DigestAuth):
+        kwargs["middlewares"] = (auth,)
+    elif auth is not None:
+        kwargs["auth"] = auth
+
+    return get_session().get(
+        url,
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        **kwargs,
+    )
+
+
+def _validators(previous_headers):
+    headers = {}
+    if previous_headers is not None:
+        if previous_headers.get("ETag"):
+            headers["If-None-Match"] = previous_headers["ETag"]
+        if previous_headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = previous_headers["Last-Modified"]
+    return headers
+
+
+async def _read_into(response, f):
+    hasher = blake2b(digest_size=16)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        f.write(chunk)
+        hasher.update(chunk)
+    return hasher.digest()
+
+
+async def fetch(
+    url,
+    headers=None,
+    auth=None,
+    timeout=DEFAULT_TIMEOUT,
+    previous_headers=None,
+    spool=False,
+    cache_ttl=None,
+    max_stale=0,
+):
+    """
+    GET a url through the shared session, returns a Response
+
+    - auth: from basic_auth() or digest_auth()
+    - timeout: for the whole request, in seconds
+    - previous_headers: headers of the last successful response for the same url. Its ETag and Last-Modified are sent as If-None-Match and If-Modified-Since, check for `status_code == 304` to see whether the content is unchanged. Not used with cache_ttl, the cache revalidates its own copy.
+    - spool: stream the body into a temporary file that moves to disk once it grows past SPOOL_MAX_SIZE, so large downloads are never held in memory as a whole
+    - cache_ttl: keep successful responses in CACHE_DIR, and return them without a request for this many seconds. Responses are cached per url, request headers and auth login. Expired responses are revalidated with a conditional request. If the request fails, the cached response is returned with `stale` set.
+    - max_stale: for this many seconds past cache_ttl, return the cached response right away with `stale` set, and revalidate it in the background
+    """
+    if cache_ttl is not None:
+        return await _fetch_cached(
+            url, headers, auth, timeout, spool, cache_ttl, max_stale
+        )
+
+    headers = dict(headers or {})
+    headers.update(_validators(previous_headers))
+
+    async with _request(url, headers, auth, timeout) as response:
+        result = Response(response.status, response.reason, response.headers.copy())
+
+        if spool:
+            result.body = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            result.digest = await _read_into(response, result.body)
+            result.body.seek(0)
+        else:
+            result.content = await response.read()
+
+    return result
+
+
+def cache_key(url, headers, auth):
+    """
+    The name of a request's cache entry. Requests that differ in headers or in who they authenticate as may get different responses, so they don't share one.
+    """
+    hasher = blake2b(url.encode(), digest_size=16)
+    for name, value in sorted((headers or {}).items()):
+        hasher.update(b"\0%s: %s" % (name.lower().encode(), value.encode()))
+    if auth is not None:
+        hasher.update(b"\0%s %s" % (type(auth).__name__.encode(), auth.login.encode()))
+    return hasher.hexdigest()
+
+
+async def _fetch_cached(url, headers, auth, timeout, spool, cache_ttl, max_stale):
+    key = cache_key(url, headers, auth)
+    entry = CacheEntry.load(key)
+
+    if entry is not None and entry.age() < cache_ttl:
+        return entry.response(spool)
+
+    task = _revalidations.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _revalidate(key, url, entry, headers, auth, timeout)
+        )
+        _revalidations[key] = task
+        task.add_done_callback(lambda _: _revalidations.pop(key, None))
+
+    if entry is not None and entry.age() < cache_ttl + max_stale:
+        task.add_done_callback(_report_failed_revalidation)
+        result = entry.response(spool)
+        result.stale = True
+        return result
+
+    try:
+        # shielded, so a caller that gives up doesn't cancel the request for everyone else waiting on it
+        fresh = await asyncio.shield(task)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if entry is None:
+            raise
+        print(f"Failed to fetch {url}, using the cached response: {e}")
+        result = entry.response(spool)
+        result.stale = True
+        return result
+
+    if isinstance(fresh, CacheEntry):
+        return fresh.response(spool)
+    if spool:
+        return _spooled(fresh)
+    return fresh
+
+
+def _spooled(response):
+    """
+    A copy of a response that wasn't cached, with its content as a spooled body. Callers waiting on the same request each get their own file.
+    """
+    result = Response(response.status_code, response.reason, response.headers.copy())
+    result.body = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    result.body.write(response.content)
+    result.body.seek(0)
+    result.digest = blake2b(response.content, digest_size=16).digest()
+    return result
+
+
+async def _revalidate(key, url, entry, headers, auth, timeout):
+    """
+    Request a url, conditionally if there is a cached copy. Returns the updated CacheEntry, or the Response if it can't be cached, like errors and 2xx other than 200. Those are read into `content`, see _spooled().
+    """
+    headers = dict(headers or {})
+    if entry is not None:
+        headers.update(_validators(entry.headers))
+
+    async with _request(url, headers, auth, timeout) as response:
+        if response.status == 304 and entry is not None:
+            entry.stored = time.time()
+            entry.save()
+            return entry
+
+        if response.status != 200:
+            result = Response(response.status, response.reason, response.headers.copy())
+            result.content = await response.read()
+            return result
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fresh = CacheEntry(
+            key, response.status, response.reason, response.headers.copy(), None, None
+        )
+        with open(fresh.path + ".body.tmp", "wb") as f:
+            fresh.digest = await _read_into(response, f)
+
+    os.replace(fresh.path + ".body.tmp", fresh.path + ".body")
+    fresh.stored = time.time()
+    fresh.save()
+    return fresh
+
+
+def _report_failed_revalidation(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Failed to revalidate a cached response: {task.exception()}")
+
+
+def get(url, **kwargs):
+    """
+    Blocking version of fetch(), for code that isn't running on the event loop
+    """
+    return run(fetch(url, **kwargs))
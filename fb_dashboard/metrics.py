@@ -0,0 +1,148 @@
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .executor import get_executor
+
+# the timings every widget keeps, see WidgetBase.timings
+WIDGET_TIMINGS = {
+    "fetch": "Time spent fetching data from the network",
+    "render": "Time spent rendering, without fetching and converting",
+    "convert": "Time spent converting rendered images into the framebuffer's pixel format",
+    "blit": "Time spent writing into the framebuffer",
+}
+
+WIDGET_COUNTERS = {
+    "renders": "Refreshes that rendered a frame",
+    "skipped_renders": "Refreshes that skipped rendering because their inputs didn't change",
+    "unchanged_frames": "Rendered frames that were identical to the previous one",
+    "overruns": "Refreshes that took longer than the widget's refresh_interval",
+    "bytes_written": "Bytes written into the framebuffer",
+}
+
+# the refresh pool's stats, see RefreshExecutor.stats()
+POOL_GAUGES = {
+    "max_workers": "Threads in the refresh pool",
+    "queued": "Refreshes waiting for a thread",
+    "running": "Refreshes running",
+    "max_queue_depth": "Most refreshes that waited for a thread at once",
+}
+
+POOL_COUNTERS = {
+    "completed": "Refreshes that finished",
+    "failed": "Refreshes that raised an exception",
+}
+
+
+class Timing:
+    def __init__(self):
+        """
+        How often something ran, and how long it took in total, the last time and at most, in seconds. Overlapping refreshes of a widget may add to it at the same time.
+        """
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.max = max(self.max, seconds)
+
+
+def format_labels(labels):
+    return ",".join(
+        '%s="%s"'
+        % (
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for key, value in labels.items()
+    )
+
+
+def collect(widgets, compositor):
+    """
+    All metrics in the Prometheus text format
+    """
+    lines = []
+
+    for key, help in WIDGET_TIMINGS.items():
+        name = "fb_dashboard_widget_%s_seconds" % key
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s summary" % name)
+        for widget in widgets:
+            labels = format_labels(
+                {"widget": widget.name, "type": type(widget).__name__}
+            )
+            timing = widget.timings[key]
+            lines.append("%s_sum{%s} %f" % (name, labels, timing.total))
+            lines.append("%s_count{%s} %d" % (name, labels, timing.count))
+
+    for key, help in WIDGET_COUNTERS.items():
+        name = "fb_dashboard_widget_%s_total" % key
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s counter" % name)
+        for widget in widgets:
+            labels = format_labels(
+                {"widget": widget.name, "type": type(widget).__name__}
+            )
+            lines.append("%s{%s} %d" % (name, labels, getattr(widget, key)))
+
+    name = "fb_dashboard_frame_seconds"
+    lines.append("# HELP %s Time spent compositing a frame" % name)
+    lines.append("# TYPE %s summary" % name)
+    lines.append("%s_sum %f" % (name, compositor.frame_time.total))
+    lines.append("%s_count %d" % (name, compositor.frame_time.count))
+
+    stats = get_executor().stats()
+    for key, help in POOL_GAUGES.items():
+        name = "fb_dashboard_refresh_pool_%s" % key
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s %d" % (name, stats[key]))
+
+    for key, help in POOL_COUNTERS.items():
+        name = "fb_dashboard_refresh_pool_%s_total" % key
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s counter" % name)
+        lines.append("%s %d" % (name, stats[key]))
+
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(widgets, compositor, port=None, socket_path=None):
+    """
+    Serve the metrics from a background thread, over HTTP on localhost:port for Prometheus, or on a Unix socket that writes them out to every connection (e.g. `nc -U path`). Returns the server.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = collect(widgets, compositor).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class SocketHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(collect(widgets, compositor).encode())
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            # left over from a previous run
+            os.unlink(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, SocketHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+from datetime import datetime as dt, timedelta, timezone
+from threading import Lock
+import numpy as np
+from .batching import BATCH_WINDOW, Batcher
+from .http_client import DEFAULT_TIMEOUT
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "widgets", "data")
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# one record per bar, `time` is nanoseconds since the epoch in UTC
+OHLCV_DTYPE = np.dtype(
+    [
+        ("time", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<f8"),
+    ]
+)
+
+PERIOD_RE = re.compile(r"^(\d+)(d|wk|mo|y)$")
+PERIOD_DAYS = {"d": 1, "wk": 7, "mo": 31, "y": 366}
+
+_store = None
+_store_lock = Lock()
+
+
+class YahooFinanceSource:
+    """
+    Downloads bars from Yahoo Finance with yfinance, several symbols per request
+    """
+
+    def download(self, symbols, interval, period=None, start=None):
+        """
+        Bars for each symbol, either for a yfinance `period` like `1mo`, or since the `start` datetime. Returns a dict of DataFrames with COLUMNS and a DatetimeIndex.
+        """
+        import pandas as pd
+        import yfinance as yf
+
+        data = yf.download(
+            tickers=list(symbols),
+            period=period,
+            start=start,
+            interval=interval,
+            group_by="ticker",
+            timeout=DEFAULT_TIMEOUT,
+            progress=False,
+        )
+
+        frames = {}
+        for symbol in symbols:
+            if isinstance(data.columns, pd.MultiIndex):
+                # (ticker, price) with group_by="ticker", older versions of yfinance ignore it for a single ticker
+                for level in range(data.columns.nlevels):
+                    if symbol in data.columns.get_level_values(level):
+                        frame = data.xs(symbol, axis=1, level=level)
+                        break
+                else:
+                    continue
+            else:
+                frame = data
+            # symbols trade on different days, the rows of the other symbols are empty
+            frames[symbol] = frame[COLUMNS].dropna(how="all")
+        return frames
+
+
+def get_store():
+    """
+    The OHLCV store shared by all stock widgets
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = OHLCVStore(DATA_DIR, YahooFinanceSource())
+        return _store
+
+
+def set_source(source):
+    """
+    Download bars with another source, like a fixture in tests. It needs a download() like YahooFinanceSource's.
+    """
+    get_store().source = source
+
+
+def period_start(period, now):
+    """
+    When a yfinance `period` starts, or None for `max`
+    """
+    if period == "max":
+        return None
+    if period == "ytd":
+        return now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    match = PERIOD_RE.match(period)
+    if not match:
+        raise ValueError("Unknown time period: %s" % period)
+    return now - timedelta(days=int(match[1]) * PERIOD_DAYS[match[2]])
+
+
+def to_records(frame):
+    import pandas as pd
+
+    index = pd.DatetimeIndex(frame.index)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+
+    records = np.zeros(len(frame), dtype=OHLCV_DTYPE)
+    records["time"] = index.tz_convert("UTC").as_unit("ns").asi8
+    for column in COLUMNS:
+        records[column.lower()] = frame[column].to_numpy(dtype=float)
+    return records
+
+
+def to_frame(records):
+    import pandas as pd
+
+    return pd.DataFrame(
+        {column: records[column.lower()] for column in COLUMNS},
+        index=pd.to_datetime(records["time"], utc=True),
+    )
+
+
+class OHLCVStore:
+    def __init__(self, directory, source, window=BATCH_WINDOW):
+        """
+        Keeps the bars of every (symbol, interval) in a NumPy file, and only downloads the ones newer than the last cached bar
+
+        Downloads of widgets that refresh at about the same time are made in one request: the first widget to ask waits `window` seconds for others to join.
+        """
+        self.directory = directory
+        self.source = source
+        self.batcher = Batcher(self.download_batch, window)
+        self.lock = Lock()
+        # held across loading, merging and saving the bars of a (symbol, interval), so widgets showing the same one don't overwrite each other's bars
+        self.series_locks = {}
+
+        # counters, for checking how well refreshes are batched
+        self.downloads = 0
+
+    def path(self, symbol, interval):
+        name = "ohlcv-%s-%s" % (symbol.replace(os.sep, "_"), interval)
+        return os.path.join(self.directory, name)
+
+    def load(self, symbol, interval):
+        """
+        The cached bars, and since when they are complete (None if since the start of the symbol's history)
+        """
+        path = self.path(symbol, interval)
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            records = np.load(path + ".npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return None, None
+
+        if records.dtype != OHLCV_DTYPE:
+            return None, None
+        return records, meta["complete_since"]
+
+    def save(self, symbol, interval, records, complete_since):
+        path = self.path(symbol, interval)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + ".npy.tmp", "wb") as f:
+            np.save(f, records)
+        os.replace(path + ".npy.tmp", path + ".npy")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump({"complete_since": complete_since}, f)
+        os.replace(path + ".json.tmp", path + ".json")
+
+    def series_lock(self, symbol, interval):
+        with self.lock:
+            return self.series_locks.setdefault((symbol, interval), Lock())
+
+    def get(self, symbol, interval, period):
+        """
+        The bars of a symbol for a yfinance `period`, as a DataFrame with COLUMNS. Only bars newer than the cached ones are downloaded.
+        """
+        with self.series_lock(symbol, interval):
+            return self.update(symbol, interval, period)
+
+    def update(self, symbol, interval, period):
+        start = period_start(period, dt.now(timezone.utc))
+        start_ns = None if start is None else int(start.timestamp() * 1e9)
+        records, complete_since = self.load(symbol, interval)
+
+        covered = records is not None and (
+            complete_since is None
+            or (start_ns is not None and complete_since <= start_ns)
+        )
+        if covered and len(records):
+            # the last cached bar may still have been open, download it again
+            last = dt.fromtimestamp(records["time"][-1] / 1e9, timezone.utc)
+            frame = self.download(symbol, interval, start=last)
+            if frame is None:
+                # no bars since the last one, like outside market hours, the cached ones are still valid
+                fresh = np.zeros(0, dtype=OHLCV_DTYPE)
+            else:
+                fresh = to_records(frame)
+        else:
+            frame = self.download(symbol, interval, period=period)
+            if frame is None:
+                raise ValueError("No data for %s" % symbol)
+            fresh = to_records(frame)
+            records = None
+            complete_since = start_ns
+
+        if records is not None and len(fresh):
+            records = np.concatenate(
+                [records[records["time"] < fresh["time"][0]], fresh]
+            )
+        elif records is None:
+            records = fresh
+
+        if len(fresh):
+            self.save(symbol, interval, records, complete_since)
+
+        if start_ns is not None:
+            records = records[records["time"] >= start_ns]
+        return to_frame(records)
+
+    def download(self, symbol, interval, period=None, start=None):
+        """
+        Download a symbol's bars, together with other symbols of the same interval that ask for the same range at about the same time. Returns None if the source had no bars for the symbol.
+        """
+        return self.batcher.submit((interval, period, start), symbol)
+
+    def download_batch(self, key, symbols):
+        """
+        Download the bars of every symbol in a batch in one request, see Batcher
+        """
+        interval, period, start = key
+        frames = self.source.download(
+            sorted(set(symbols)), interval, period=period, start=start
+        )
+        with self.lock:
+            self.downloads += 1
+        return [frames.get(symbol) for symbol in symbols]
@@ -0,0 +1,134 @@
+from PIL import Image
+
+# byte aligned layouts that PIL can pack and unpack itself, keyed by
+# (bits_per_pixel, red offset, green offset, blue offset, alpha offset)
+PIL_RAW_MODES = {
+    (32, 16, 8, 0, 24): ("RGBA", "BGRA"),
+    (32, 0, 8, 16, 24): ("RGBA", "RGBA"),
+    (32, 16, 8, 0, None): ("RGB", "BGRX"),
+    (32, 0, 8, 16, None): ("RGB", "RGBX"),
+    (24, 16, 8, 0, None): ("RGB", "BGR"),
+    (24, 0, 8, 16, None): ("RGB", "RGB"),
+}
+
+
+class PixelFormat:
+    def __init__(self, bits_per_pixel, red, green, blue, transp=(0, 0)):
+        """
+        The pixel layout of a framebuffer, mirroring the kernel's fb_bitfield.
+
+        Pixels are little endian integers of `bits_per_pixel` bits, and each channel is an (offset, length) bitfield within them.
+        """
+        if bits_per_pixel not in (16, 24, 32):
+            raise ValueError("Unsupported bits per pixel")
+
+        self.bits_per_pixel = bits_per_pixel
+        self.bytes_per_pixel = bits_per_pixel // 8
+        self.bitfields = (tuple(red), tuple(green), tuple(blue), tuple(transp))
+
+        key = (bits_per_pixel,) + tuple(
+            offset if length == 8 else None for offset, length in self.bitfields
+        )
+        self.raw_mode = PIL_RAW_MODES.get(key)
+
+    @classmethod
+    def from_bits_per_pixel(cls, bits_per_pixel):
+        """
+        The usual layout for a bit depth, when the kernel doesn't tell us: BGRA, BGR or RGB565
+        """
+        if bits_per_pixel == 32:
+            return cls(32, (16, 8), (8, 8), (0, 8), (24, 8))
+        elif bits_per_pixel == 24:
+            return cls(24, (16, 8), (8, 8), (0, 8))
+        elif bits_per_pixel == 16:
+            return cls(16, (11, 5), (5, 6), (0, 5))
+        else:
+            raise ValueError("Unsupported bits per pixel")
+
+    @classmethod
+    def from_var_screeninfo(cls, var):
+        """
+        Read the layout from an unpacked fb_var_screeninfo, as returned by FBIOGET_VSCREENINFO
+        """
+        return cls(var[6], var[8:10], var[11:13], var[14:16], var[17:19])
+
+    def __repr__(self):
+        return "PixelFormat(%s, %s)" % (self.bits_per_pixel, self.bitfields)
+
+    def pack_color(self, color):
+        """
+        Pack an (r, g, b, a) color into the bytes of a single pixel
+        """
+        value = 0
+        for channel, (offset, length) in zip(color, self.bitfields):
+            if not length:
+                continue
+            elif length <= 8:
+                value |= (channel >> (8 - length)) << offset
+            else:
+                value |= (channel << (length - 8)) << offset
+
+        return value.to_bytes(self.bytes_per_pixel, byteorder="little")
+
+    def tobytes(self, image):
+        """
+        Convert a PIL image into raw pixels in this format
+        """
+        if self.raw_mode:
+            mode, raw_mode = self.raw_mode
+            if image.mode != mode:
+                image = image.convert(mode)
+            return image.tobytes("raw", raw_mode)
+
+        import numpy as np
+
+        rgba = np.asarray(image.convert("RGBA"), dtype=np.uint32)
+        value = np.zeros(rgba.shape[:2], dtype=np.uint32)
+        for channel, (offset, length) in enumerate(self.bitfields):
+            if not length:
+                continue
+            elif length <= 8:
+                value |= (rgba[..., channel] >> (8 - length)) << offset
+            else:
+                value |= (rgba[..., channel] << (length - 8)) << offset
+
+        if self.bytes_per_pixel == 2:
+            return value.astype("<u2").tobytes()
+        elif self.bytes_per_pixel == 3:
+            return (
+                value.astype("<u4")
+                .view(np.uint8)
+                .reshape(value.shape + (4,))[..., :3]
+                .tobytes()
+            )
+        else:
+            return value.astype("<u4").tobytes()
+
+    def to_image(self, buffer, width, height):
+        """
+        Convert raw pixels in this format back into an RGBA PIL image
+        """
+        if self.raw_mode:
+            mode, raw_mode = self.raw_mode
+            image = Image.frombuffer(
+                mode, (width, height), buffer, "raw", raw_mode, 0, 1
+            )
+            return image.convert("RGBA")
+
+        import numpy as np
+
+        raw = np.frombuffer(
+            buffer, dtype=np.uint8, count=width * height * self.bytes_per_pixel
+        )
+        raw = raw.reshape(height, width, self.bytes_per_pixel)
+        value = np.zeros((height, width), dtype=np.uint32)
+        for i in range(self.bytes_per_pixel):
+            value |= raw[..., i].astype(np.uint32) << (8 * i)
+
+        rgba = np.full((height, width, 4), 255, dtype=np.uint8)
+        for channel, (offset, length) in enumerate(self.bitfields):
+            if length:
+                max_value = (1 << length) - 1
+                rgba[..., channel] = ((value >> offset) & max_value) * 255 // max_value
+
+        return Image.fromarray(rgba)
@@ -0,0 +1,149 @@
+import builtins
+import importlib
+import importlib.util
+import sys
+import time
+from importlib.metadata import entry_points
+
+# third party widgets register under this entry point group, as `Type = "package.module:WidgetClass"`
+ENTRY_POINT_GROUP = "fb_dashboard.widgets"
+
+# the built in widgets, by the `type` used in the config
+BUILTIN_WIDGETS = {
+    "Image": "fb_dashboard.widgets.image:ImageWidget",
+    "Text": "fb_dashboard.widgets.text:TextWidget",
+    "Clock": "fb_dashboard.widgets.clock:ClockWidget",
+    "Metric": "fb_dashboard.widgets.big_metric:BigMetricWidget",
+    "StockMarketCandlestick": "fb_dashboard.widgets.stock_candlestick:YFCandlestickWidget",
+    "CloudWatchMetricImage": "fb_dashboard.widgets.cloudwatch_metric:CloudWatchImageWidget",
+    "SatelliteMap": "fb_dashboard.widgets.satellite:SatelliteWidget",
+    "Weather": "fb_dashboard.widgets.weather:WeatherWidget",
+}
+
+
+class WidgetRegistry:
+    def __init__(self, widgets=BUILTIN_WIDGETS):
+        """
+        Maps a widget `type` to its class, importing the widget's module the first time the type is used. Config files that only use a few widgets don't pay for the dependencies of the others, like boto3 or skyfield.
+
+        Types that aren't built in are looked up in the ENTRY_POINT_GROUP entry points of installed packages.
+        """
+        self.specs = dict(widgets)
+        self.classes = {}
+        self.entry_points_loaded = False
+
+    def register(self, kind, spec):
+        """
+        Register a widget type, as a class or a "module:Class" string that is imported when it's first used
+        """
+        self.specs[kind] = spec
+        self.classes.pop(kind, None)
+
+    def load_entry_points(self):
+        if self.entry_points_loaded:
+            return
+        self.entry_points_loaded = True
+
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            # built in types can't be replaced
+            self.specs.setdefault(entry_point.name, entry_point.value)
+
+    def get(self, kind):
+        """
+        The widget class for a type, or None if there is no such type
+        """
+        if kind in self.classes:
+            return self.classes[kind]
+
+        if kind not in self.specs:
+            self.load_entry_points()
+        spec = self.specs.get(kind)
+        if spec is None:
+            return None
+
+        if isinstance(spec, str):
+            module_name, _, class_name = spec.partition(":")
+            widget_class = importlib.import_module(module_name)
+            for attribute in class_name.split("."):
+                widget_class = getattr(widget_class, attribute)
+        else:
+            widget_class = spec
+
+        self.classes[kind] = widget_class
+        return widget_class
+
+    def types(self):
+        self.load_entry_points()
+        return sorted(self.specs)
+
+
+class ImportProfiler:
+    def __init__(self):
+        """
+        Times every module imported while it is installed, like `python -X importtime`. Each module's own time excludes the modules it imports.
+        """
+        self.original_import = None
+        self.stack = []
+        self.self_times = {}
+        self.total_times = {}
+
+    def install(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        builtins.__import__ = self.original_import
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules and not fromlist:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        module = name
+        if level:
+            package = (globals or {}).get("__package__") or ""
+            module = importlib.util.resolve_name("." * level + name, package)
+
+        # `from package import submodule` imports the submodule, not the package
+        candidates = ["%s.%s" % (module, item) for item in fromlist or ()]
+        candidates.append(module)
+
+        return self.timed(
+            candidates, self.original_import, name, globals, locals, fromlist, level
+        )
+
+    def timed(self, name, fn, *args):
+        """
+        Call fn, and record how long it took under `name` if it imported anything. `name` can also be a list of the modules an import statement may have imported, it's recorded under the first of them that is new.
+        """
+        modules_before = set(sys.modules)
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+
+            new_modules = set(sys.modules) - modules_before
+            if new_modules:
+                if not isinstance(name, str):
+                    name = next((n for n in name if n in new_modules), name[-1])
+                self.self_times[name] = (
+                    self.self_times.get(name, 0) + elapsed - children
+                )
+                self.total_times[name] = self.total_times.get(name, 0) + elapsed
+
+    def report(self, limit=20):
+        """
+        The modules that took the longest to import, as printable lines
+        """
+        lines = ["%10s | %10s | module" % ("self [ms]", "total [ms]")]
+        slowest = sorted(self.total_times, key=self.total_times.get, reverse=True)
+        for name in slowest[:limit]:
+            lines.append(
+                "%10.1f | %10.1f | %s"
+                % (self.self_times[name] * 1000, self.total_times[name] * 1000, name)
+            )
+        return lines
@@ -1,25 +1,41 @@
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 from .util import eval_padding
 
 
-def autosize_text_into_size(text, font, max_width, max_height):
+@lru_cache(maxsize=256)
+def get_font(size, face=None):
     """
-    Resizes the font size to fit the text into the given bounds
+    Load a font once per process, keyed by face and size
+
+    - face: path to a truetype font, or None for PIL's default font
+    """
+    if face is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(face, size)
+
+
+@lru_cache(maxsize=1024)
+def fit_font_size(text, max_width, max_height, face=None):
     """
-    # Start with a large font size
-    font_size = max_height
-    font = ImageFont.load_default(font_size)
-    text_width = font.getlength(text)
-    text_height = font.size
+    Largest font size at which `text` fits into the given bounds, found with a binary search and memoized per text and box
+    """
+    low, high = 1, max(int(max_height), 1)
+    while low < high:
+        size = (low + high + 1) // 2
+        if get_font(size, face).getlength(text) <= max_width:
+            low = size
+        else:
+            high = size - 1
 
-    # Reduce the font size until it fits
-    while text_width > max_width or text_height > max_height:
-        font_size -= 1
-        font = ImageFont.load_default(font_size)
-        text_width = font.getlength(text)
-        text_height = font.size
+    return low
 
-    return font
+
+def autosize_text_into_size(text, font, max_width, max_height, face=None):
+    """
+    Resizes the font size to fit the text into the given bounds
+    """
+    return get_font(fit_font_size(text, max_width, max_height, face), face)
 
 
 def autodraw_text(draw, text, box, max_font_size=None, **kwargs):
@@ -28,12 +44,12 @@ def autodraw_text(draw, text, box, max_font_size=None, **kwargs):
     """
     Automatically draw text into a box, resizing the font as necessary
     """
-    font = autosize_text_into_size(text, ImageFont.load_default(1), width, height)
+    font = autosize_text_into_size(text, None, width, height)
 
     if max_font_size:
         actual_max_size = eval_padding(max_font_size, height)
         if font.size > actual_max_size:
-            font = ImageFont.load_default(actual_max_size)
+            font = get_font(actual_max_size)
 
     if kwargs.get("anchor"):
         anchor = kwargs.get("anchor")
@@ -110,7 +126,7 @@ def draw_layout_boxes(
         # else:
         #     texts[root_coord] = box_id + '#box'
 
-    font = ImageFont.load_default(height / 48)
+    font = get_font(height / 48)
     for coord, txt in texts.items():
         draw.text(coord, txt, fill=text_color, font=font)
 
@@ -165,3 +181,19 @@ def draw_image_into_bounds(draw, image, box):
 
     image_resized = image.resize((width, height), Image.Resampling.LANCZOS)
     draw.bitmap((x, y), image_resized.tobytes("raw", "BGRA"), width, height)
+
+
+def open_image_for_size(source, width, height):
+    """
+    Open an image and resize it to (width, height), decoding as little of it as possible.
+
+    JPEGs are scaled down by libjpeg while decoding (by 1/2, 1/4 or 1/8, never below the target size), and the remaining downscale reduces by whole factors before resampling.
+
+    - source: a path or file object
+    """
+    image = Image.open(source)
+
+    if image.format == "JPEG":
+        image.draft(image.mode, (width, height))
+
+    return image.resize((width, height), reducing_gap=3.0)
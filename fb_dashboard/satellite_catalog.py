@@ -0,0 +1,127 @@
+import os
+import numpy as np
+from sgp4.api import Satrec, WGS72
+from skyfield.api import EarthSatellite
+from skyfield.iokit import parse_tle_file
+
+# julian date of the 1949 December 31 00:00 UT epoch that sgp4init counts days from
+SGP4_EPOCH_JD = 2433281.5
+
+# one record per satellite, sorted by name. `index` is the satellite's position in the TLE file.
+CATALOG_DTYPE = np.dtype(
+    [
+        ("name", "U32"),
+        ("index", "<i4"),
+        ("satnum", "<i4"),
+        ("jdsatepoch", "<f8"),
+        ("jdsatepochF", "<f8"),
+        ("bstar", "<f8"),
+        ("ndot", "<f8"),
+        ("nddot", "<f8"),
+        ("ecco", "<f8"),
+        ("argpo", "<f8"),
+        ("inclo", "<f8"),
+        ("mo", "<f8"),
+        ("no_kozai", "<f8"),
+        ("nodeo", "<f8"),
+    ]
+)
+
+
+def build_catalog(tle_path, catalog_path, ts):
+    """
+    Parse a TLE file once, and save the orbital elements as a NumPy record array
+    """
+    with open(tle_path, "rb") as tle_file:
+        satellites = list(parse_tle_file(tle_file, ts))
+
+    catalog = np.zeros(len(satellites), dtype=CATALOG_DTYPE)
+    for i, satellite in enumerate(satellites):
+        model = satellite.model
+        catalog[i] = (
+            satellite.name or "",
+            i,
+            model.satnum,
+            model.jdsatepoch,
+            model.jdsatepochF,
+            model.bstar,
+            model.ndot,
+            model.nddot,
+            model.ecco,
+            model.argpo,
+            model.inclo,
+            model.mo,
+            model.no_kozai,
+            model.nodeo,
+        )
+
+    # sorted by name, so names can be looked up with a binary search
+    catalog = catalog[np.argsort(catalog["name"], kind="stable")]
+
+    with open(catalog_path + ".tmp", "wb") as f:
+        np.save(f, catalog)
+    os.replace(catalog_path + ".tmp", catalog_path)
+
+
+def load_catalog(tle_path, ts):
+    """
+    Memory map the catalog for a TLE file, (re)building it when the TLE file is newer
+    """
+    catalog_path = os.path.splitext(tle_path)[0] + ".catalog.npy"
+
+    if not os.path.exists(catalog_path) or os.path.getmtime(
+        catalog_path
+    ) < os.path.getmtime(tle_path):
+        build_catalog(tle_path, catalog_path, ts)
+
+    catalog = np.load(catalog_path, mmap_mode="r")
+    if catalog.dtype != CATALOG_DTYPE:
+        # written by an older version
+        build_catalog(tle_path, catalog_path, ts)
+        catalog = np.load(catalog_path, mmap_mode="r")
+
+    return catalog
+
+
+def find_satellites(catalog, names=None):
+    """
+    Positions in the catalog of the satellites with the given names, or of every satellite if names is empty. Returned in TLE file order.
+    """
+    if not names:
+        positions = np.arange(len(catalog))
+    else:
+        catalog_names = catalog["name"]
+        names = np.asarray(names, dtype=catalog_names.dtype)
+        starts = np.searchsorted(catalog_names, names, side="left")
+        ends = np.searchsorted(catalog_names, names, side="right")
+        positions = np.unique(
+            [p for start, end in zip(starts, ends) for p in range(start, end)]
+        ).astype(int)
+
+    return positions[np.argsort(catalog["index"][positions])]
+
+
+def make_satellite(record, ts):
+    """
+    Rebuild a skyfield EarthSatellite from a catalog record, without parsing any TLE text
+    """
+    satrec = Satrec()
+    satrec.sgp4init(
+        WGS72,
+        "i",
+        int(record["satnum"]),
+        float(record["jdsatepoch"] - SGP4_EPOCH_JD + record["jdsatepochF"]),
+        float(record["bstar"]),
+        float(record["ndot"]),
+        float(record["nddot"]),
+        float(record["ecco"]),
+        float(record["argpo"]),
+        float(record["inclo"]),
+        float(record["mo"]),
+        float(record["no_kozai"]),
+        float(record["nodeo"]),
+    )
+
+    satellite = EarthSatellite.from_satrec(satrec, ts)
+    satellite.name = str(record["name"]) or None
+    return satellite
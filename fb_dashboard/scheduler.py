@@ -0,0 +1,69 @@
+import heapq
+import time
+from threading import Condition
+
+
+class Scheduler:
+    def __init__(self, widgets):
+        """
+        Keeps a priority queue of when each widget is next due to refresh.
+
+        The main loop sleeps until the next deadline, or until a background refresh finishes and the screen needs redrawing, instead of polling every widget on a fixed interval.
+        """
+        self.widgets = widgets
+        self.queue = []
+        self.scheduled = set()
+        self.finished = []
+        self.condition = Condition()
+
+        for index, widget in enumerate(widgets):
+            widget.refresh_callback = self.refresh_finished
+            self.schedule(index, widget)
+
+    def schedule(self, index, widget):
+        if index in self.scheduled:
+            return
+
+        # the index breaks ties, so widgets themselves are never compared
+        heapq.heappush(self.queue, (widget.next_refresh_time(), index, widget))
+        self.scheduled.add(index)
+
+    def refresh_finished(self, widget):
+        """
+        Called from a widget's refresh thread when it is done
+        """
+        with self.condition:
+            self.finished.append(widget)
+            self.condition.notify()
+
+    def start_due_refreshes(self):
+        """
+        Start a background refresh for every widget that is due. A widget is not rescheduled until its refresh finishes.
+        """
+        now = time.time()
+        while self.queue and self.queue[0][0] <= now:
+            due, index, widget = heapq.heappop(self.queue)
+            self.scheduled.discard(index)
+
+            # widgets are rescheduled when their refresh finishes, or right away if they allow overlapping refreshes
+            if widget.refresh_in_bg() and widget.can_refresh_in_bg():
+                self.schedule(index, widget)
+
+    def wait(self):
+        """
+        Sleep until the next refresh is due, or until a refresh finishes. Returns the widgets that finished refreshing.
+        """
+        with self.condition:
+            if not self.finished:
+                timeout = None
+                if self.queue:
+                    timeout = max(self.queue[0][0] - time.time(), 0)
+                self.condition.wait(timeout)
+
+            finished = self.finished
+            self.finished = []
+
+        for widget in finished:
+            self.schedule(self.widgets.index(widget), widget)
+
+        return finished
@@ -1,9 +1,31 @@
-from datetime import datetime as dt, timedelta
-from threading import Thread
+from datetime import datetime as dt
+from threading import Lock, local
+from hashlib import blake2b
+import time
+import os
+import traceback
+from ..executor import (
+    get_executor,
+    get_process_pool,
+    create_shared_memory,
+    render_in_process,
+)
+from ..pixel_format import PixelFormat
+from ..metrics import Timing, WIDGET_TIMINGS
+from ..util import eval_expr
+
+# how long to wait before retrying a refresh that failed, in seconds
+RETRY_INTERVAL = 5
 
 
 class WidgetBase:
     def __init__(self, x, y, width, height, config):
+        # kept so worker processes can build their own copy of the widget
+        self._init_args = (x, y, width, height, config)
+
+        # the section name in the config, set when the dashboard creates the widget
+        self.name = type(self).__name__
+
         self.x = int(x)
         self.y = int(y)
         self.width = int(width)
@@ -19,32 +41,367 @@ class WidgetBase:
         else:
             self.refresh_interval = 60
 
+        # `thread` refreshes in the shared thread pool, `process` renders in a worker process to avoid holding the GIL
+        self.executor = config.get("executor", "thread")
+        if self.executor not in ("thread", "process"):
+            raise ValueError("Unknown executor: %s" % self.executor)
+        self._shared_memory = None
+
+        # how many refreshes of this widget may run in the shared pool at once
+        self.max_concurrent_refreshes = int(config.get("max_concurrent_refreshes", 1))
+        if (
+            self.max_concurrent_refreshes > 1
+            and type(self).fetch is not WidgetBase.fetch
+        ):
+            # fetch() hands its result to the next refresh through the widget, overlapping refreshes would take each other's
+            print(
+                "%s fetches in the background, max_concurrent_refreshes is limited to 1"
+                % type(self).__name__
+            )
+            self.max_concurrent_refreshes = 1
+        elif self.max_concurrent_refreshes > 1 and self.executor == "process":
+            # the worker writes the frame into a single shared memory block, a second refresh would overwrite it while it's being read
+            print(
+                "%s renders in a worker process, max_concurrent_refreshes is limited to 1"
+                % type(self).__name__
+            )
+            self.max_concurrent_refreshes = 1
+
         # refresh state
         self.last_refresh = None
+        self.last_refresh_attempt = None
         self.has_refreshed = False
-        self._refresh_thread = None
+        self.refreshes_in_flight = 0
+        self._refresh_lock = Lock()
+
+        # set when fetch() already ran on the event loop for the upcoming refresh
+        self.prefetched = False
+
+        # keep fetched responses in the disk cache, and show ones up to max_stale seconds past their ttl at startup, see fetch_url()
+        self.http_cache = eval_expr(config.get("http_cache", "True"), {})
+        # responses to authenticated requests are private, they are only written to disk when asked for
+        self.http_cache_auth = eval_expr(config.get("http_cache_auth", "False"), {})
+        self.max_stale = int(config.get("max_stale", 24 * 60 * 60))
+        # set when the last fetch returned a cached response that is being revalidated
+        self.stale = False
+        # refreshes in a row that showed stale content, to back off while the server is unreachable
+        self.stale_refreshes = 0
+
+        # called with the widget when a background refresh finishes, set by the scheduler
+        self.refresh_callback = None
+
+        # rendered pixels in the framebuffer's format, set by subclasses with set_image() when they refresh
+        self.pixel_format = PixelFormat.from_bits_per_pixel(32)
+        self.bytes = None
+        self.bytes_per_pixel = self.pixel_format.bytes_per_pixel
+
+        # bumped on every refresh that changed the pixels, so the compositor can tell which widgets need redrawing
+        self.generation = 0
+        self.frame_changed = False
+
+        # hashes of the last render's inputs and output, so unchanged renders can be skipped
+        self.input_hash = None
+        self.pending_input_hash = None
+        self.frame_hash = None
+
+        # counters, see render_stats()
+        self.renders = 0
+        self.skipped_renders = 0
+        self.unchanged_frames = 0
+
+        # instrumentation, see metrics.collect()
+        self.timings = {key: Timing() for key in WIDGET_TIMINGS}
+        # time spent fetching and converting in the refresh running on this thread, which isn't render time
+        self._refresh_stages = local()
+        self.overruns = 0
+        self.bytes_written = 0
+
+    async def fetch(self):
+        """
+        Fetch what the widget needs from the network, on the shared event loop (see http_client.fetch)
+
+        When refreshing in the thread pool, this runs before refresh() is queued, so waiting on the network doesn't hold a refresh thread. Widgets that implement it call fetch_if_needed() at the start of refresh(), which covers refreshes that didn't go through the event loop first.
+        """
+
+    def fetch_if_needed(self):
+        """
+        Run fetch(), unless it already ran for this refresh
+        """
+        if self.prefetched:
+            self.prefetched = False
+            return
+
+        from .. import http_client
 
-    def refresh(self):
+        self.stale = False
+        start = time.perf_counter()
+        try:
+            http_client.run(self.fetch())
+        finally:
+            self.add_refresh_time("fetch", time.perf_counter() - start)
+
+    async def fetch_url(self, url, ttl=0, **kwargs):
+        """
+        Fetch a url from fetch(), through the disk cache unless `http_cache` is off, or the request has `auth` and `http_cache_auth` is off. Takes the same arguments as http_client.fetch.
+
+        - ttl: how long a cached response is used without a request, in seconds. With the default of 0 every refresh revalidates it, and the cache only saves requests across restarts.
+
+        Until the widget has rendered once, a cached response up to max_stale seconds past its ttl is returned right away and revalidated in the background, so the last known content shows at startup. The widget then refreshes again soon, see next_refresh_time().
+        """
+        from .. import http_client
+
+        if not self.http_cache or (
+            kwargs.get("auth") is not None and not self.http_cache_auth
+        ):
+            return await http_client.fetch(url, **kwargs)
+
+        response = await http_client.fetch(
+            url,
+            cache_ttl=ttl,
+            max_stale=0 if self.has_refreshed else self.max_stale,
+            **kwargs,
+        )
+        self.stale = self.stale or response.stale
+        return response
+
+    def refresh(self, changed=True):
         """
         Refresh the widget
+
+        - changed: pass False when the refresh didn't change the rendered image, so the compositor doesn't redraw it
         """
         # print('Refreshed widget %s @ %s' % (self.__class__.__name__, dt.now()))
         self.last_refresh = dt.now()
         self.has_refreshed = True
+        self.stale_refreshes = self.stale_refreshes + 1 if self.stale else 0
 
-    def refresh_in_bg_if_needed(self):
-        # if the thread is still running, skip the refresh
-        if self._refresh_thread and self._refresh_thread.is_alive():
-            # print('Thread is still running, skipping refresh for %s' % self.__class__.__name__)
+        if self.pending_input_hash is not None:
+            # the render succeeded, its inputs can be compared against from now on
+            self.input_hash = self.pending_input_hash
+            self.pending_input_hash = None
+
+        if not changed:
+            self.skipped_renders += 1
+        elif self.frame_changed:
+            self.generation += 1
+        self.frame_changed = False
+
+    def inputs_unchanged(self, *inputs):
+        """
+        Hash everything a render depends on, like fetched data or downloaded bytes. Returns True if it's the same as for the last successful render, in which case the subclass can skip rendering and call refresh(changed=False).
+
+        The widget's size and pixel format are always part of the hash, other config is fixed for the widget's lifetime.
+        """
+        hasher = blake2b(digest_size=16)
+        hasher.update(repr((self.width, self.height, self.pixel_format)).encode())
+        for value in inputs:
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                hasher.update(value)
+            else:
+                hasher.update(repr(value).encode())
+        digest = hasher.digest()
+
+        if digest == self.input_hash and self.bytes is not None:
+            return True
+
+        self.pending_input_hash = digest
+        return False
+
+    def set_image(self, image):
+        """
+        Convert a rendered image into the framebuffer's pixel format, once per refresh rather than once per frame
+        """
+        start = time.perf_counter()
+        data = self.pixel_format.tobytes(image)
+        self.add_refresh_time("convert", time.perf_counter() - start)
+        self.set_bytes(data)
+
+    def add_refresh_time(self, key, seconds):
+        """
+        Record time spent fetching or converting during a refresh, so it isn't counted as render time too
+        """
+        self.timings[key].add(seconds)
+        self._refresh_stages.excluded = (
+            getattr(self._refresh_stages, "excluded", 0.0) + seconds
+        )
+
+    def set_bytes(self, data):
+        """
+        Replace the rendered pixels, unless they are byte for byte the same as the current ones. Returns whether they changed.
+        """
+        self.renders += 1
+
+        digest = blake2b(data, digest_size=16).digest()
+        if digest == self.frame_hash and self.bytes is not None:
+            self.unchanged_frames += 1
+            return False
+
+        self.frame_hash = digest
+        self.bytes = data
+        self.bytes_per_pixel = self.pixel_format.bytes_per_pixel
+        self.frame_changed = True
+        return True
+
+    def render_stats(self):
+        """
+        How many refreshes rendered a frame, skipped rendering because nothing changed, or rendered the same pixels as before
+        """
+        return {
+            "renders": self.renders,
+            "skipped_renders": self.skipped_renders,
+            "unchanged_frames": self.unchanged_frames,
+        }
+
+    def next_refresh_time(self):
+        """
+        Unix timestamp of when the widget should refresh next
+        """
+        if self.last_refresh_attempt is None:
+            return time.time()
+
+        if self.refreshes_in_flight:
+            # the next refresh may overlap with this one, if max_concurrent_refreshes allows it
+            return self.last_refresh_attempt + self.refresh_interval
+
+        if (
+            self.last_refresh is None
+            or self.last_refresh.timestamp() < self.last_refresh_attempt
+        ):
+            # the last refresh failed, try again soon
+            return self.last_refresh_attempt + min(
+                self.refresh_interval, RETRY_INTERVAL
+            )
+
+        if self.stale:
+            # showing cached content while it is revalidated, refresh again once it's fresh. If it stays stale the server is likely unreachable, back off up to refresh_interval.
+            backoff = RETRY_INTERVAL * 2 ** min(self.stale_refreshes - 1, 16)
+            return self.last_refresh.timestamp() + min(self.refresh_interval, backoff)
+
+        return self.last_refresh.timestamp() + self.refresh_interval
+
+    def can_refresh_in_bg(self):
+        return self.refreshes_in_flight < self.max_concurrent_refreshes
+
+    def refresh_in_bg(self):
+        """
+        Queue a refresh on the shared refresh pool, returns False if max_concurrent_refreshes are already in flight
+        """
+        with self._refresh_lock:
+            if not self.can_refresh_in_bg():
+                # print('Refresh is still running, skipping refresh for %s' % self.__class__.__name__)
+                return False
+
+            self.refreshes_in_flight += 1
+            self.last_refresh_attempt = time.time()
+
+        if self.executor == "thread" and type(self).fetch is not WidgetBase.fetch:
+            # aiohttp is only imported by widgets that fetch something
+            from .. import http_client
+
+            http_client.submit(self._fetch_and_refresh())
+        else:
+            get_executor().submit(self._refresh_and_notify)
+        return True
+
+    async def _fetch_and_refresh(self):
+        self.stale = False
+        start = time.perf_counter()
+        submitted = False
+        try:
+            try:
+                await self.fetch()
+            finally:
+                self.timings["fetch"].add(time.perf_counter() - start)
+
+            self.prefetched = True
+            get_executor().submit(self._refresh_and_notify)
+            submitted = True
+        except Exception:
+            traceback.print_exc()
+            get_executor().record_failure()
+        finally:
+            # failed or cancelled before the refresh was queued, which would have finished it
+            if not submitted:
+                self._refresh_finished()
+
+    def refresh_in_process(self):
+        """
+        Render the widget in a worker process. The frame comes back through shared memory, so it is copied once rather than pickled.
+        """
+        size = self.width * self.height * self.pixel_format.bytes_per_pixel
+        if self._shared_memory is None or self._shared_memory.size < size:
+            self._shared_memory = create_shared_memory(size)
+
+        key = "%s:%s" % (os.getpid(), id(self))
+        future = get_process_pool(key).submit(
+            render_in_process,
+            key,
+            type(self),
+            self._init_args,
+            self.pixel_format,
+            self._shared_memory.name,
+        )
+        length, skipped, changed = future.result()
+
+        # only the bookkeeping from here on, the subclass's refresh already ran in the worker
+        if skipped and self.bytes is not None:
+            WidgetBase.refresh(self, changed=False)
             return
 
+        if changed or self.bytes is None:
+            self.set_bytes(bytes(self._shared_memory.buf[:length]))
+        else:
+            # the worker rendered the same pixels again, counted like set_bytes() would
+            self.renders += 1
+            self.unchanged_frames += 1
+
+        WidgetBase.refresh(self)
+
+    def _refresh_and_notify(self):
+        start = time.perf_counter()
+        # fetching and converting during the refresh are timed on their own
+        self._refresh_stages.excluded = 0.0
+        try:
+            if self.executor == "process":
+                self.refresh_in_process()
+            else:
+                self.refresh()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings["render"].add(elapsed - self._refresh_stages.excluded)
+            if elapsed > self.refresh_interval:
+                self.overruns += 1
+            self._refresh_finished()
+
+    def _refresh_finished(self):
+        with self._refresh_lock:
+            self.refreshes_in_flight -= 1
+
+        if self.refresh_callback:
+            self.refresh_callback(self)
+
+    def refresh_in_bg_if_needed(self):
         """
-      Refresh the widget if it's time
-    """
-        if not self.last_refresh:
-            self._refresh_thread = Thread(target=self.refresh)
-            self._refresh_thread.start()
+        Refresh the widget if it's time
+        """
+        if time.time() >= self.next_refresh_time():
+            self.refresh_in_bg()
+
+    def write_into_fb(self, fb):
+        """
+        Write the rendered image into the framebuffer
+        """
+        if not self.has_refreshed or not self.bytes:
+            return
 
-        elif dt.now() - self.last_refresh > timedelta(seconds=self.refresh_interval):
-            self._refresh_thread = Thread(target=self.refresh)
-            self._refresh_thread.start()
+        start = time.perf_counter()
+        fb.blit(
+            self.x,
+            self.y,
+            self.width,
+            self.height,
+            self.bytes,
+            self.width * self.bytes_per_pixel,
+        )
+        self.timings["blit"].add(time.perf_counter() - start)
+        self.bytes_written += len(self.bytes)
@@ -1,8 +1,8 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from .base import WidgetBase
 from ..util import eval_expr, parse_color
+from ..render_util import fit_font_size, get_font
 from datetime import datetime as dt
-import requests
 
 
 def get_keypath(obj, keypath):
@@ -24,22 +24,11 @@ class BigMetricWidget(WidgetBase):
         self.refresh_interval = 60 * 5
 
     def find_font_size(self, test_text, height, width):
-        font_size = 1
+        font_size = fit_font_size(test_text, 0.9 * width, 0.9 * height)
+        return min(font_size, 0.5 * height)
 
-        for i in range(height):
-            font = ImageFont.load_default(font_size)
-            length = font.getlength(test_text)
-            if length > 0.9 * width or font_size > 0.9 * height:
-                break
-            font_size += 1
-
-        if font_size > 0.5 * height:
-            font_size = 0.5 * height
-
-        return font_size
-
-    def fetch_data(self):
-        data = requests.get(self.url)
+    async def fetch(self):
+        data = await self.fetch_url(self.url)
         if self.mode == "json":
             data = data.json()
         else:
@@ -51,15 +40,19 @@ class BigMetricWidget(WidgetBase):
         """
         Write the text into the framebuffer
         """
+        self.fetch_if_needed()
+        print(self.data)
+
+        if self.inputs_unchanged(self.data):
+            super().refresh(changed=False)
+            return
+
         image = Image.new("RGBA", (self.width, self.height), self.bg_color)
         draw = ImageDraw.Draw(image)
 
-        self.fetch_data()
-        print(self.data)
-
         self.size = self.find_font_size(self.data, self.height, self.width)
-        font = ImageFont.load_default(self.size)
-        date_font = ImageFont.load_default(0.25 * self.size)
+        font = get_font(self.size)
+        date_font = get_font(0.25 * self.size)
 
         font_top = self.height - self.size - 0.25 * self.size - 0.25 * self.size
 
@@ -80,21 +73,5 @@ class BigMetricWidget(WidgetBase):
         )
 
         img_resized = image.resize((self.width, self.height), Image.Resampling.LANCZOS)
-        self.bytes = img_resized.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
+        self.set_image(img_resized)
         super().refresh()
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.has_refreshed:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
@@ -1,10 +1,16 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from .base import WidgetBase
 from ..util import eval_expr, parse_color
 from datetime import datetime as dt
 import pytz
+import math
+import re
+import time
 from ..sfxbox import SimpleFlexBox
-from ..render_util import autodraw_text, draw_layout_boxes
+from ..render_util import autosize_text_into_size, draw_layout_boxes, get_font
+
+# strftime directives that change every second
+SECONDS_DIRECTIVES = ("%S", "%T", "%X", "%c", "%r", "%s", "%f")
 
 
 class ClockWidget(WidgetBase):
@@ -16,38 +22,20 @@ class ClockWidget(WidgetBase):
         self.clock_format = config.get("clock_format", "%H:%M:%S")
         self.date_format = config.get("date_format", "%Y-%m-%d")
         self.timezone = config.get("timezone")
-        self.refresh_interval = 0.25
-
-        font_size = 1
-
-        test_text = dt.now().strftime(self.clock_format)
-        for i in range(height):
-            font = ImageFont.load_default(font_size)
-            length = font.getlength(test_text)
-            if length > 0.9 * width or font_size > 0.9 * height:
-                break
-            font_size += 1
-
-        self.size = font_size
-
-    def refresh(self):
-        """
-        Write the text into the framebuffer
-        """
-        image = Image.new("RGBA", (self.width, self.height), self.bg_color)
-        draw = ImageDraw.Draw(image)
-        font = ImageFont.load_default(self.size)
+        self.tz = pytz.timezone(self.timezone) if self.timezone else None
 
-        date_font = ImageFont.load_default(0.25 * self.size)
-
-        if not self.timezone:
-            text = dt.now().strftime(self.clock_format)
-            date_text = dt.now().strftime(self.date_format)
+        # only tick once a minute when neither format shows seconds
+        formats = self.clock_format + self.date_format
+        if any(directive in formats for directive in SECONDS_DIRECTIVES):
+            self.tick = 1
         else:
-            tz = pytz.timezone(self.timezone)
-            text = dt.now(tz).strftime(self.clock_format)
-            date_text = dt.now(tz).strftime(self.date_format)
+            self.tick = 60
+
+        # the interval bounds a redraw's expected duration and the retry after a failure
+        if not config.get("refresh_interval"):
+            self.refresh_interval = self.tick
 
+        # the layout only depends on the geometry, so compute it once
         layout_box = SimpleFlexBox(
             identifier="root",
             flex_direction="column",
@@ -60,46 +48,91 @@ class ClockWidget(WidgetBase):
                 SimpleFlexBox(identifier="bottom_spacer"),
             ],
         )
-        layout = layout_box.compute_sizes(self.x, self.y, self.width, self.height)
+        self.layout = layout_box.compute_sizes(0, 0, self.width, self.height)
 
-        if self.debug:
-            draw_layout_boxes(draw, layout, self.width, self.height)
-
-        autodraw_text(draw, text, layout["clock"]["content_box"], anchor="mm")
-        autodraw_text(draw, date_text, layout["date"]["content_box"], anchor="mm")
-
-        # # print(x, y, self.size)
-        # draw.text(
-        #     (self.width // 2, self.height // 2),
-        #     text,
-        #     fill=self.fg_color,
-        #     font=font,
-        #     anchor="mm",
-        # )
-        # draw.text(
-        #     (self.width // 2, self.height // 2 + self.size / 2 + 0.25 * self.size),
-        #     date_text,
-        #     fill=self.fg_color,
-        #     font=date_font,
-        #     anchor="mm",
-        # )
-
-        img_resized = image.resize((self.width, self.height), Image.Resampling.LANCZOS)
-        self.bytes = img_resized.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
-        super().refresh()
+        # fonts are sized for the text with every digit replaced by the widest one, so the size stays put as the time changes
+        reference_font = get_font(100)
+        self.widest_digit = max("0123456789", key=reference_font.getlength)
+
+        # rendered glyph masks, keyed by (character, font size)
+        self.glyphs = {}
 
-    def write_into_fb(self, fb):
+    def next_refresh_time(self):
         """
-        Write the image into the framebuffer
+        Redraw right on the next second (or minute) boundary, rather than up to refresh_interval late
         """
-        if not self.has_refreshed:
-            return
+        if self.last_refresh is None:
+            return super().next_refresh_time()
+
+        return (math.floor(time.time() / self.tick) + 1) * self.tick
+
+    def font_for(self, text, box):
+        """
+        Font that fits `text` into `box`, sized for the text's shape rather than its digits
+        """
+        shape = re.sub(r"\d", self.widest_digit, text)
+        return autosize_text_into_size(shape, None, box[2], box[3])
+
+    def glyph(self, char, font):
+        """
+        Render a single character into a mask once, returns (mask, left, top) relative to the pen position on the baseline
+        """
+        key = (char, font.size)
+        if key not in self.glyphs:
+            left, top, right, bottom = font.getbbox(char, anchor="ls")
+            if right <= left or bottom <= top:
+                mask = None
+            else:
+                mask = Image.new("L", (right - left, bottom - top), 0)
+                ImageDraw.Draw(mask).text(
+                    (-left, -top), char, fill=255, font=font, anchor="ls"
+                )
+            self.glyphs[key] = (mask, left, top)
+        return self.glyphs[key]
+
+    def draw_text(self, draw, text, box):
+        """
+        Draw text centered in the box from cached glyphs, equivalent to draw.text() with anchor="mm"
+        """
+        font = self.font_for(text, box)
+        ascent, descent = font.getmetrics()
+
+        x, y, width, height = box
+        origin_x = x + width / 2 - font.getlength(text) / 2
+        baseline = y + height / 2 + (ascent - descent) / 2
 
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
+        for i, char in enumerate(text):
+            mask, left, top = self.glyph(char, font)
+            if mask is None:
+                continue
+
+            # measure the prefix, so kerning is kept
+            pen_x = origin_x + font.getlength(text[:i])
+            draw.bitmap(
+                (round(pen_x + left), round(baseline + top)), mask, fill=self.fg_color
             )
+
+    def refresh(self):
+        """
+        Write the text into the framebuffer
+        """
+        now = dt.now(self.tz)
+        text = now.strftime(self.clock_format)
+        date_text = now.strftime(self.date_format)
+
+        # nothing visible changed, skip rendering
+        if self.inputs_unchanged(text, date_text):
+            super().refresh(changed=False)
+            return
+
+        image = Image.new("RGBA", (self.width, self.height), self.bg_color)
+        draw = ImageDraw.Draw(image)
+
+        if self.debug:
+            draw_layout_boxes(draw, self.layout, self.width, self.height)
+
+        self.draw_text(draw, text, self.layout["clock"]["content_box"])
+        self.draw_text(draw, date_text, self.layout["date"]["content_box"])
+
+        self.set_image(image)
+        super().refresh()
@@ -1,11 +1,35 @@
-import requests
 from io import BytesIO
-from PIL import Image, ImageOps
-from requests.auth import HTTPDigestAuth, HTTPBasicAuth
+from PIL import Image, ImageDraw, ImageOps
+from datetime import datetime as dt, timedelta, timezone
 from .base import WidgetBase
-import boto3
 import json
-from ..util import eval_expr
+from ..util import eval_expr, parse_color
+from ..render_util import get_font, open_image_for_size
+from .. import cloudwatch
+
+# CloudWatch's default line colors
+PALETTE = [
+    "#1f77b4",
+    "#ff7f0e",
+    "#2ca02c",
+    "#d62728",
+    "#9467bd",
+    "#8c564b",
+    "#e377c2",
+    "#7f7f7f",
+    "#bcbd22",
+    "#17becf",
+]
+
+
+def format_value(value):
+    """
+    Shorten an axis value, like 1.2k or 3.4M
+    """
+    for limit, suffix in ((1e12, "T"), (1e9, "G"), (1e6, "M"), (1e3, "k")):
+        if abs(value) >= limit:
+            return "%.3g%s" % (value / limit, suffix)
+    return "%.3g" % value
 
 
 class CloudWatchImageWidget(WidgetBase):
@@ -18,61 +42,170 @@ class CloudWatchImageWidget(WidgetBase):
         self.aws_profile = config.get("aws_profile", None)
         self.aws_region = config.get("aws_region", None)
         self.invert_image = eval_expr(config.get("invert", "False"), {})
-        self.bytes = None
+
+        # fetch the datapoints with GetMetricData and draw the chart here, instead of downloading a rendered image
+        self.render_locally = eval_expr(config.get("render_locally", "False"), {})
+        self.bg_color = parse_color(config.get("bg_color", "#ffffff"))
+        self.fg_color = parse_color(config.get("fg_color", "#000000"))
+        if self.render_locally:
+            self.queries = cloudwatch.metric_queries(json.loads(self.widget))
 
     def refresh(self):
         """
         Refresh the image from cloudwatch
         """
-        self.load_image()
-        super().refresh()
+        if self.render_locally:
+            changed = self.load_data()
+        else:
+            changed = self.load_image()
+        super().refresh(changed)
 
     def load_image(self):
         """
         Load the image from cloudwatch
-        """
-        if self.aws_profile or self.aws_region:
-            boto3_session = boto3.session.Session(
-                profile_name=self.aws_profile, region_name=self.aws_region
-            )
-            cloudwatch = boto3_session.client("cloudwatch")
-        else:
-            cloudwatch = boto3.client("cloudwatch")
 
-        response = cloudwatch.get_metric_widget_image(
+        Returns False if the image is the same as last time, in which case it is not decoded again
+        """
+        client = cloudwatch.get_client(self.aws_profile, self.aws_region)
+        response = client.get_metric_widget_image(
             MetricWidget=self.widget, OutputFormat="png"
         )
 
         raw_bytes = response["MetricWidgetImage"]
-        self.raw_image = Image.open(BytesIO(raw_bytes))
-        self.image = self.raw_image.resize((self.width, self.height))
+        if self.inputs_unchanged(raw_bytes):
+            return False
 
-        if self.invert_image:
-            self.image = ImageOps.invert(self.image)
+        self.image = open_image_for_size(BytesIO(raw_bytes), self.width, self.height)
+        return self.show_image()
+
+    def load_data(self):
+        """
+        Fetch the datapoints, batched with other widgets using the same AWS profile and region, and draw the chart
+
+        Returns False if the datapoints are the same as last time, in which case the chart is not drawn again
+        """
+        widget = json.loads(self.widget)
+
+        # rounded down to the minute, so widgets refreshing together ask for the same range and share a batch
+        now = dt.now(timezone.utc).replace(second=0, microsecond=0)
+        start = cloudwatch.parse_time(widget.get("start", "-PT3H"), now)
+        end = cloudwatch.parse_time(widget.get("end", "P0D"), now)
 
-        # ensure the image has an alpha channel
-        if not self.image.has_transparency_data:
-            # https://stackoverflow.com/a/46366964
-            a_channel = Image.new(
-                "L", self.image.size, 255
-            )  # 'L' 8-bit pixels, black and white
-            self.image.putalpha(a_channel)
+        series = cloudwatch.get_batcher(
+            self.aws_profile, self.aws_region
+        ).get_metric_data(self.queries, start, end)
+        if self.inputs_unchanged(start, end, series):
+            return False
 
-        # convert to BGRA format
-        self.bytes = self.image.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
+        self.image = self.render_chart(widget, series, start, end)
+        return self.show_image()
+
+    def show_image(self):
+        if self.invert_image:
+            self.image = ImageOps.invert(self.image.convert("RGB"))
 
-    def write_into_fb(self, fb):
+        # convert to the framebuffer's pixel format
+        self.set_image(self.image)
+        return True
+
+    def render_chart(self, widget, series, start, end):
         """
-        Write the image into the framebuffer
+        Draw the datapoints as a line chart, with a title, the value range on the left, the time range below and a legend with each metric's latest value
         """
-        if not self.bytes:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
+        image = Image.new("RGB", (self.width, self.height), self.bg_color)
+        draw = ImageDraw.Draw(image)
+
+        font = get_font(max(10, self.height // 18))
+        line_height = font.getbbox("Ag")[3]
+        padding = max(4, self.height // 40)
+        axis_color = tuple(
+            (f + 2 * b) // 3 for f, b in zip(self.fg_color, self.bg_color)
+        )
+
+        top = padding
+        if widget.get("title"):
+            draw.text((padding, top), widget["title"], font=font, fill=self.fg_color)
+            top += line_height + padding
+
+        values = [value for _, _, series_values in series for value in series_values]
+        y_axis = widget.get("yAxis", {}).get("left", {})
+        low = y_axis.get("min", min(values, default=0))
+        high = y_axis.get("max", max(values, default=1))
+        if high <= low:
+            high = low + 1
+
+        labels = [format_value(high), format_value(low)]
+        left = (
+            padding
+            + max(draw.textlength(label, font=font) for label in labels)
+            + padding
+        )
+        right = self.width - padding
+        bottom = self.height - 2 * (line_height + padding) - padding
+        if bottom <= top or right <= left:
+            return image
+
+        draw.text(
+            (left - padding, top), labels[0], font=font, fill=self.fg_color, anchor="ra"
+        )
+        draw.text(
+            (left - padding, bottom),
+            labels[1],
+            font=font,
+            fill=self.fg_color,
+            anchor="rd",
+        )
+        draw.line((left, top, left, bottom, right, bottom), fill=axis_color)
+
+        time_format = "%H:%M" if end - start <= timedelta(days=1) else "%m/%d %H:%M"
+        for when, anchor in ((start, "la"), (end, "ra")):
+            draw.text(
+                (left if anchor == "la" else right, bottom + padding),
+                when.astimezone().strftime(time_format),
+                font=font,
+                fill=self.fg_color,
+                anchor=anchor,
+            )
+
+        duration = (end - start).total_seconds() or 1
+        line_width = max(1, self.height // 150)
+        legend_x = padding
+        legend_y = self.height - line_height - padding
+
+        for index, (label, timestamps, series_values) in enumerate(series):
+            color = parse_color(PALETTE[index % len(PALETTE)])
+            points = [
+                (
+                    left + (right - left) * (when - start).total_seconds() / duration,
+                    # values outside a fixed yAxis range are clipped to the plot
+                    min(
+                        max(
+                            bottom - (bottom - top) * (value - low) / (high - low), top
+                        ),
+                        bottom,
+                    ),
+                )
+                for when, value in zip(timestamps, series_values)
+            ]
+            if len(points) > 1:
+                draw.line(points, fill=color, width=line_width, joint="curve")
+            elif points:
+                draw.point(points, fill=color)
+
+            text = label or ""
+            if series_values:
+                text += " " + format_value(series_values[-1])
+            draw.rectangle(
+                (
+                    legend_x,
+                    legend_y,
+                    legend_x + line_height - 1,
+                    legend_y + line_height - 1,
+                ),
+                fill=color,
             )
+            legend_x += line_height + padding // 2
+            draw.text((legend_x, legend_y), text, font=font, fill=self.fg_color)
+            legend_x += draw.textlength(text, font=font) + 2 * padding
+
+        return image
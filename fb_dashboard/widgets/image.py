@@ -1,9 +1,8 @@
-import requests
-from io import BytesIO
+import os
 from PIL import Image, ImageOps
 from ..util import eval_expr
-from requests.auth import HTTPDigestAuth, HTTPBasicAuth
 from .base import WidgetBase
+from ..render_util import open_image_for_size
 
 
 class ImageWidget(WidgetBase):
@@ -11,14 +10,20 @@ class ImageWidget(WidgetBase):
         super().__init__(x, y, width, height, config)
         self.path = config["path"]
         self.invert_image = eval_expr(config.get("invert", "False"), {})
-        self.bytes = None
 
         # allow for basic auth or digest auth to be used for password protected images
         if config.get("username") and config.get("password"):
+            # aiohttp is only imported for widgets that download
+            from .. import http_client
+
             if config.get("auth_type") == "basic" or not config.get("auth_type"):
-                self.auth = HTTPBasicAuth(config["username"], config["password"])
+                self.auth = http_client.basic_auth(
+                    config["username"], config["password"]
+                )
             elif config.get("auth_type") == "digest":
-                self.auth = HTTPDigestAuth(config["username"], config["password"])
+                self.auth = http_client.digest_auth(
+                    config["username"], config["password"]
+                )
             else:
                 print(f'Unknown auth type: {config.get("auth_type")}')
                 exit(1)
@@ -26,55 +31,65 @@ class ImageWidget(WidgetBase):
         else:
             self.auth = None
 
+        # headers of the last successful download, or the mtime of the local file, to tell whether the image changed
+        self.last_headers = None
+        self.last_mtime = None
+        self.response = None
+
+    def is_remote(self):
+        return self.path.startswith("http") or self.path.startswith("https")
+
+    async def fetch(self):
+        if self.is_remote():
+            self.response = await self.fetch_url(
+                self.path,
+                auth=self.auth,
+                previous_headers=self.last_headers,
+                spool=True,
+            )
+
     def refresh(self):
-        self.load_image()
-        super().refresh()
+        changed = self.load_image()
+        super().refresh(changed)
 
     def load_image(self):
         """
         Load the static image from the path, or download it from the internet
+
+        Returns False if the image is unchanged since the last load, in which case it is not decoded again
         """
-        if self.path.startswith("http") or self.path.startswith("https"):
-            req = requests.get(self.path, auth=self.auth, timeout=10)
+        if self.is_remote():
+            self.fetch_if_needed()
+            req, self.response = self.response, None
 
-            if not req.ok:
+            if req.status_code == 304 and self.bytes is not None:
+                return False
+            elif not req.ok:
                 print(
                     f"Failed to download image from {self.path}: {req.status_code} ({req.reason})"
                 )
-                self.raw_image = Image.new("RGBA", (self.width, self.height))
+                self.last_headers = None
+                self.image = Image.new("RGBA", (self.width, self.height))
             else:
-                self.raw_image = Image.open(BytesIO(req.content))
+                self.last_headers = req.headers
+
+                with req.body:
+                    if self.inputs_unchanged(req.digest):
+                        # the server doesn't support validators, but sent the same image
+                        return False
+
+                    self.image = open_image_for_size(req.body, self.width, self.height)
         else:
-            self.raw_image = Image.open(self.path)
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.last_mtime and self.bytes is not None:
+                return False
 
-        self.image = self.raw_image.resize((self.width, self.height))
+            self.last_mtime = mtime
+            self.image = open_image_for_size(self.path, self.width, self.height)
 
         if self.invert_image:
             self.image = ImageOps.invert(self.image)
 
-        # ensure the image has an alpha channel
-        if not self.image.has_transparency_data:
-            # https://stackoverflow.com/a/46366964
-            a_channel = Image.new(
-                "L", self.image.size, 255
-            )  # 'L' 8-bit pixels, black and white
-            self.image.putalpha(a_channel)
-
-        # convert to BGRA format
-        self.bytes = self.image.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.has_refreshed:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
+        # convert to the framebuffer's pixel format
+        self.set_image(self.image)
+        return True
@@ -0,0 +1,55 @@
+from PIL import Image, ImageDraw
+from .base import WidgetBase
+from ..util import parse_color
+from ..render_util import get_font
+
+COLUMNS = ["widget", "render ms", "fetch ms", "renders", "skipped", "overruns"]
+
+
+class MetricsOverlayWidget(WidgetBase):
+    def __init__(self, x, y, width, height, config):
+        """
+        Draws every widget's last render and fetch time and its counters on top of the dashboard, see --metrics-overlay
+
+        `widgets` and `compositor` are set by the dashboard once they exist.
+        """
+        super().__init__(x, y, width, height, config)
+        self.size = int(config.get("size", 12))
+        self.bg_color = parse_color(config.get("bg_color", "#000000"))
+        self.fg_color = parse_color(config.get("fg_color", "#ffff00"))
+        self.widgets = []
+        self.compositor = None
+
+    def rows(self):
+        rows = [COLUMNS]
+        for widget in self.widgets:
+            rows.append(
+                [
+                    widget.name,
+                    "%.1f" % (widget.timings["render"].last * 1000),
+                    "%.1f" % (widget.timings["fetch"].last * 1000),
+                    str(widget.renders),
+                    str(widget.skipped_renders),
+                    str(widget.overruns),
+                ]
+            )
+        if self.compositor is not None:
+            rows.append(["frame", "%.1f" % (self.compositor.frame_time.last * 1000)])
+        return rows
+
+    def refresh(self):
+        image = Image.new("RGB", (self.width, self.height), self.bg_color)
+        draw = ImageDraw.Draw(image)
+        font = get_font(self.size)
+        line_height = round(self.size * 1.3)
+
+        # the name gets twice as much room as the numbers
+        column_width = self.width / (len(COLUMNS) + 1)
+        for row_index, row in enumerate(self.rows()):
+            y = row_index * line_height
+            for column_index, text in enumerate(row):
+                x = 0 if column_index == 0 else (column_index + 1) * column_width
+                draw.text((x, y), text, font=font, fill=self.fg_color)
+
+        self.set_image(image)
+        super().refresh()
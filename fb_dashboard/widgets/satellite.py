@@ -1,18 +1,43 @@
 # https://celestrak.org/NORAD/elements/gp.php?GROUP=stations&FORMAT=tle
-import requests
 from io import BytesIO
 from PIL import Image, ImageOps, ImageDraw, ImageFont
 from ..util import eval_expr, parse_color
-from requests.auth import HTTPDigestAuth, HTTPBasicAuth
 from .base import WidgetBase
+from ..render_util import get_font
+from ..basemap import render_basemap
+from ..satellite_catalog import load_catalog, find_satellites, make_satellite
 import os
 from datetime import datetime as dt, timedelta
 
 from skyfield.api import load
-from skyfield.iokit import parse_tle_file
 from skyfield.api import wgs84
+from skyfield.sgp4lib import theta_GMST1982
+from sgp4.api import SatrecArray, jday
 from hashlib import sha256
-import json
+import numpy as np
+
+# minutes around now that a track covers
+TRACK_MINUTES = np.arange(-30, 30)
+
+# WGS84 ellipsoid, for converting batch propagated positions to latitude
+WGS84_RADIUS_KM = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+WGS84_E2 = WGS84_FLATTENING * (2 - WGS84_FLATTENING)
+
+
+def rasterize_segment(x0, y0, x1, y1, width):
+    """
+    Rasterize a line segment the way draw.line() would, returns (left, top, mask) with a boolean mask of the covered pixels
+    """
+    left = min(x0, x1) - width
+    top = min(y0, y1) - width
+    image = Image.new(
+        "L", (abs(x1 - x0) + 2 * width + 1, abs(y1 - y0) + 2 * width + 1), 0
+    )
+    ImageDraw.Draw(image).line(
+        (x0 - left, y0 - top, x1 - left, y1 - top), fill=1, width=width
+    )
+    return left, top, np.asarray(image, dtype=bool)
 
 
 class SatelliteWidget(WidgetBase):
@@ -50,40 +75,26 @@ class SatelliteWidget(WidgetBase):
         self.label_font_size = eval_expr(
             config.get("label_font_size", "0.015 * w"), {"w": width, "h": height}
         )
+        self.batch_propagation = eval_expr(config.get("batch_propagation", "false"), {"w": width, "h": height})
 
 
         dirname = os.path.dirname(__file__)
         filename = os.path.join(dirname, "./data/world.geo.json")
         self.refresh_interval = 60
         self.last_tle_refresh = None
-
-        geojson = open(filename, "r")
-        geo_data = json.loads(geojson.read())
-        geojson.close()
-
-        self.geo_data = geo_data
-
-        self.bg_image = Image.new("RGB", (width, height), color=self.bg_color)
-        draw = ImageDraw.Draw(self.bg_image)
-
-        # draw the geojson data
-        for feature in geo_data["features"]:
-            coords = feature["geometry"]["coordinates"]
-            if feature["geometry"]["type"] == "Polygon":
-                for feat in coords:
-                    to_draw = []
-                    for coord in feat:
-                        to_draw.append(self.latlon_to_xy(coord[1], coord[0]))
-
-                    draw.polygon(to_draw, outline=self.map_color, fill=self.map_fill_color, width=self.map_stroke_width)
-            elif feature["geometry"]["type"] == "MultiPolygon":
-                for feat in coords:
-                    to_draw = []
-                    for coord in feat:
-                        for c in coord:
-                            to_draw.append(self.latlon_to_xy(c[1], c[0]))
-
-                    draw.polygon(to_draw, outline=self.map_color, fill=self.map_fill_color, width=self.map_stroke_width)
+        self.satellites = []
+
+        self.bg_image = render_basemap(
+            filename,
+            width,
+            height,
+            self.bg_color,
+            self.map_color,
+            self.map_fill_color,
+            self.map_stroke_width,
+        )
+        self.background = np.asarray(self.bg_image)
+        self.reset_tracks()
 
     def refresh(self):
         if not self.last_tle_refresh or dt.now() - self.last_tle_refresh > timedelta(
@@ -97,79 +108,207 @@ class SatelliteWidget(WidgetBase):
 
     def refresh_tle(self):
         ts = load.timescale()
-        url_hash = str(sha256(self.tle_url.encode()).hexdigest())
 
-        dirname = os.path.dirname(__file__)
-        pathname = os.path.join(dirname, "data", f"{url_hash}.tle")
+        if os.path.exists(self.tle_url):
+            # a local TLE file, used as it is
+            pathname = self.tle_url
+        else:
+            url_hash = str(sha256(self.tle_url.encode()).hexdigest())
 
-        if not self.last_tle_refresh:
-            print("loading TLE from", self.tle_url)
-            print("caching in", url_hash)
+            dirname = os.path.dirname(__file__)
+            pathname = os.path.join(dirname, "data", f"{url_hash}.tle")
 
-        if not load.exists(pathname) or load.days_old(pathname) > 1:
-            print("TLE is stale, downloading new data")
-            load.download(self.tle_url, pathname)
+            if not self.last_tle_refresh:
+                print("loading TLE from", self.tle_url)
+                print("caching in", url_hash)
 
-        tle_file = open(pathname, "rb")
-        self.satellites = list(parse_tle_file(tle_file, ts))
+            if not load.exists(pathname) or load.days_old(pathname) > 1:
+                print("TLE is stale, downloading new data")
+                load.download(self.tle_url, pathname)
+
+        # the parsed elements are cached in a memory mapped catalog, only the filtered satellites are built
+        catalog = load_catalog(pathname, ts)
+        satellites = [
+            make_satellite(catalog[position], ts)
+            for position in find_satellites(catalog, self.satellite_filter)
+        ]
+
+        # the tracks are indexed by satellite, start over if the satellites changed. Updated elements for the same satellites just apply to new minutes.
+        names = [satellite.name for satellite in satellites]
+        if names != [satellite.name for satellite in self.satellites]:
+            self.reset_tracks()
+
+        self.satellites = satellites
+
+    def propagate(self, satellites, times):
+        """
+        Sub-satellite points of each satellite at each time, as (lat, lon) arrays in degrees of shape (len(satellites), len(times)). Points a satellite can't be propagated to are NaN.
+        """
+        if self.batch_propagation:
+            return self.propagate_batch(satellites, times)
+
+        lat = np.empty((len(satellites), len(times)))
+        lon = np.empty((len(satellites), len(times)))
+        for i, satellite in enumerate(satellites):
+            # one vectorized SGP4 evaluation over the whole time array
+            clat, clon = wgs84.latlon_of(satellite.at(times))
+            lat[i] = clat.degrees
+            lon[i] = clon.degrees
+
+        return lat, lon
+
+    def propagate_batch(self, satellites, times):
+        """
+        Propagate every satellite at once with sgp4's SatrecArray, and convert its TEME positions to WGS84 latitude and longitude with NumPy.
+        """
+        if not satellites:
+            return np.empty((0, len(times))), np.empty((0, len(times)))
+
+        # SGP4 takes UTC julian dates, like EarthSatellite.at()
+        jd, fraction = jday(*times.utc)
+        satrecs = SatrecArray([satellite.model for satellite in satellites])
+        error, position, velocity = satrecs.sgp4(jd, fraction)
+        x, y, z = position[..., 0], position[..., 1], position[..., 2]
+
+        # TEME -> ITRS is a rotation about the z axis by the sidereal angle, which leaves the latitude alone
+        theta, theta_dot = theta_GMST1982(times.whole, times.ut1_fraction)
+        lon = np.degrees(np.arctan2(y, x) - theta)
+        lon = (lon + 180) % 360 - 180
+
+        r = np.sqrt(x * x + y * y)
+        lat = np.arctan2(z, r)
+        for iteration in range(3):
+            sin_lat = np.sin(lat)
+            radius = WGS84_RADIUS_KM / np.sqrt(1 - WGS84_E2 * sin_lat * sin_lat)
+            lat = np.arctan2(z + radius * WGS84_E2 * sin_lat, r)
+
+        lat = np.degrees(lat)
+        lat[error != 0] = np.nan
+        lon[error != 0] = np.nan
+        return lat, lon
+
+    def reset_tracks(self):
+        """
+        Clear the track layer, the next render draws every track from scratch
+        """
+        self.track_start = None
+        self.track_lon = None
+        self.track_x = None
+        self.track_y = None
+
+        # number of track segments covering each pixel, so expired segments can be erased without redrawing the rest
+        self.coverage = np.zeros((self.height, self.width), dtype=np.int16)
+        self.track_layer = self.background.copy()
+
+    def propagate_minutes(self, satellites, ts, first_minute, count):
+        """
+        Propagate to `count` whole minutes starting at `first_minute`, returns (lon, x, y) arrays of shape (len(satellites), count)
+        """
+        times = ts.tt_jd((first_minute + np.arange(count)) / 1440)
+        lat, lon = self.propagate(satellites, times)
+
+        # NaN points are never drawn, don't warn about casting them
+        with np.errstate(invalid="ignore"):
+            x = ((lon + 180) * self.width / 360).astype(int)
+            y = ((90 - lat) * self.height / 180).astype(int)
+
+        return lon, x, y
+
+    def update_tracks(self, satellites, ts, now):
+        """
+        Advance the track layer to the minute window around `now`.
+
+        Track points are aligned to whole minutes, so as time moves on only the minutes entering the window are propagated and drawn, and only the minutes leaving it are erased.
+        """
+        window = len(TRACK_MINUTES)
+        start = int(now.tt * 1440) + TRACK_MINUTES[0]
+
+        if self.track_start is not None and 0 <= start - self.track_start < window:
+            shift = start - self.track_start
+            if not shift:
+                return
+
+            self.draw_segments(range(shift), -1)
+
+            lon, x, y = self.propagate_minutes(
+                satellites, ts, self.track_start + window, shift
+            )
+            self.track_lon = np.concatenate((self.track_lon[:, shift:], lon), axis=1)
+            self.track_x = np.concatenate((self.track_x[:, shift:], x), axis=1)
+            self.track_y = np.concatenate((self.track_y[:, shift:], y), axis=1)
+
+            self.draw_segments(range(window - 1 - shift, window - 1), 1)
+        else:
+            self.reset_tracks()
+            self.track_lon, self.track_x, self.track_y = self.propagate_minutes(
+                satellites, ts, start, window
+            )
+            self.draw_segments(range(window - 1), 1)
+
+        self.track_start = start
+
+    def draw_segments(self, columns, delta):
+        """
+        Add (delta=1) or erase (delta=-1) the track segments starting at the given columns of the track arrays
+        """
+        columns = np.asarray(columns)
+
+        # tracks break where they cross the antimeridian, or can't be propagated
+        lon = self.track_lon
+        # NaN comparisons are False, so points that failed to propagate are skipped too
+        drawn = np.abs(lon[:, columns + 1] - lon[:, columns]) <= 180
+
+        for i, column in np.argwhere(drawn):
+            j = columns[column]
+            self.draw_segment(
+                int(self.track_x[i, j]),
+                int(self.track_y[i, j]),
+                int(self.track_x[i, j + 1]),
+                int(self.track_y[i, j + 1]),
+                delta,
+            )
+
+    def draw_segment(self, x0, y0, x1, y1, delta):
+        left, top, mask = rasterize_segment(x0, y0, x1, y1, self.track_width)
+
+        # clip against the widget
+        x_start, y_start = max(left, 0), max(top, 0)
+        x_end = min(left + mask.shape[1], self.width)
+        y_end = min(top + mask.shape[0], self.height)
+        if x_end <= x_start or y_end <= y_start:
+            return
+
+        mask = mask[y_start - top : y_end - top, x_start - left : x_end - left]
+        region = (slice(y_start, y_end), slice(x_start, x_end))
+
+        coverage = self.coverage[region]
+        coverage[mask] += delta
+        self.track_layer[region] = np.where(
+            (coverage > 0)[..., None], self.track_color[:3], self.background[region]
+        )
 
     def render(self):
         ts = load.timescale()
+        now = ts.now()
+
+        print("Loaded", len(self.satellites), "satellites")
+
+        satellites = self.satellites
+        self.update_tracks(satellites, ts, now)
 
-        new_image = self.bg_image.copy()
+        # pins and labels are drawn over a copy of the track layer
+        new_image = Image.fromarray(self.track_layer)
         draw = ImageDraw.Draw(new_image)
 
-        print("Loaded", len(self.satellites), "satellites")
+        lat, lon = self.propagate(satellites, ts.tt_jd(np.array([now.tt])))
 
         labels = []
 
-        for satellite in self.satellites:
-            if self.satellite_filter and satellite.name not in self.satellite_filter:
-                continue
-
-            geocentric = satellite.at(ts.now())
-            lat, lon = wgs84.latlon_of(geocentric)
-            hr_track = []
-            for i in range(0, 60):
-                g_pos = satellite.at(
-                    ts.now() - timedelta(minutes=30) + timedelta(minutes=i)
-                )
-                clat, clon = wgs84.latlon_of(g_pos)
-                screen_coord = self.latlon_to_xy(clat.degrees, clon.degrees)
-                hr_track.append(screen_coord)
-
-            # find the differences between each point in the track
-            dx_track = []
-            dy_track = []
-            for i in range(1, len(hr_track)):
-                dx_track.append(abs(hr_track[i][0] - hr_track[i - 1][0]))
-                dy_track.append(abs(hr_track[i][1] - hr_track[i - 1][1]))
-
-            # find the median of the differences
-            median_dx = sorted(dx_track)[len(dx_track) // 2]
-            median_dy = sorted(dy_track)[len(dy_track) // 2]
-
-            out_tracks = []
-            cur_track = []
-            for i, coord in enumerate(hr_track):
-                cur_track.append(coord)
-
-                if i == len(hr_track) - 1:
-                    pass  # last coord is always added
-
-                # if the difference between the current point and the previous point is > 4* the median, split the track
-                elif dx_track[i] > median_dx * 4 or dy_track[i] > median_dy * 4:
-                    out_tracks.append(cur_track)
-                    cur_track = []
-
-            out_tracks.append(cur_track)
-
-            for track in out_tracks:
-                if len(track) > 1:
-                    draw.line(track, fill=self.track_color, width=self.track_width)
-
-            x, y = self.latlon_to_xy(lat.degrees, lon.degrees)
-            labels.append((x, y, satellite))
+        for i, satellite in enumerate(satellites):
+            if np.isfinite(lon[i, 0]):
+                x = int((lon[i, 0] + 180) * self.width / 360)
+                y = int((90 - lat[i, 0]) * self.height / 180)
+                labels.append((x, y, satellite))
 
         for (x, y, satellite) in labels:
             draw.ellipse(
@@ -184,36 +323,12 @@ class SatelliteWidget(WidgetBase):
 
         # render labels after all satellites have been drawn
         if self.label_font_size and self.render_labels:
+            font = get_font(self.label_font_size)
             for (x, y, satellite) in labels:
-                font = ImageFont.load_default(self.label_font_size)
                 label_coord = (x + int(self.pin_radius * 1.5), y + int(self.pin_radius * 1.5))
                 bbox = draw.textbbox(label_coord, satellite.name, font=font, anchor='lt')
                 draw.rectangle(bbox, fill=self.label_bg_color)
                 draw.text(label_coord, satellite.name, fill=self.label_color, font=font, anchor='lt')
 
-        # ensure the image has an alpha channel
-        if not new_image.has_transparency_data:
-            # https://stackoverflow.com/a/46366964
-            a_channel = Image.new(
-                "L", new_image.size, 255
-            )  # 'L' 8-bit pixels, black and white
-            new_image.putalpha(a_channel)
-
-        # convert to BGRA format
-        self.bytes = new_image.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.has_refreshed:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
+        # convert to the framebuffer's pixel format
+        self.set_image(new_image)
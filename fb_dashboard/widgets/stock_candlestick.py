@@ -1,8 +1,10 @@
-from ..util import eval_expr
+from ..util import eval_expr, parse_color
 from io import BytesIO
-from PIL import Image
+from PIL import Image, ImageDraw
+import numpy as np
 from .base import WidgetBase
-from io import BytesIO
+from .. import ohlcv
+from ..render_util import get_font
 from datetime import datetime as dt, timedelta
 
 
@@ -12,38 +14,157 @@ class YFCandlestickWidget(WidgetBase):
 
         # parse configuration
         self.symbol = config["symbol"]
+        # `native` draws the chart straight into an image of the widget's size, `mplfinance` plots it with matplotlib
+        self.renderer = config.get("renderer", "native")
+        if self.renderer not in ("native", "mplfinance"):
+            raise ValueError("Unknown renderer: %s" % self.renderer)
         # mpf style, see https://github.com/matplotlib/mplfinance/blob/master/examples/styles.ipynb
         self.plot_style = config.get("plot_style", "nightclouds")
         self.up_color = config.get("up_color", "#00FF00")
         self.down_color = config.get("down_color", "#FF0000")
+        # colors of the native renderer
+        self.bg_color = parse_color(config.get("bg_color", "#000000"))
+        self.fg_color = parse_color(config.get("fg_color", "#ffffff"))
         # ['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']
         self.time_period = config.get("time_period", "1mo")
         # [1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo]
         self.interval = config.get("interval", "1d")
         self.show_volume = eval_expr(config.get("show_volume", "True"), {})
 
-        self.bytes = None
-
     def refresh(self):
         """
         refresh the image and data
         """
-        self.render_data()
-        super().refresh()
+        changed = self.render_data()
+        super().refresh(changed)
 
     def render_data(self):
+        import pandas as pd
+
+        # only the bars newer than the cached ones are downloaded, together with other stock widgets that are due
+        data = ohlcv.get_store().get(self.symbol, self.interval, self.time_period)
+
+        # outside market hours the candles don't change, skip plotting
+        if self.inputs_unchanged(pd.util.hash_pandas_object(data).values.tobytes()):
+            return False
+
+        if self.renderer == "native":
+            self.image = self.render_candles(data)
+        else:
+            self.image = self.render_mplfinance(data)
+
+        # convert to the framebuffer's pixel format
+        self.set_image(self.image)
+        return True
+
+    def render_candles(self, data):
+        """
+        Draw the candles, and the volume below them, directly into an image of the widget's size
+        """
+        data = data.dropna(subset=["Open", "High", "Low", "Close"])
+        image = Image.new("RGB", (self.width, self.height), self.bg_color)
+        draw = ImageDraw.Draw(image)
+
+        font = get_font(max(10, self.height // 18))
+        line_height = font.getbbox("Ag")[3]
+        padding = max(4, self.height // 40)
+        axis_color = tuple(
+            (f + 2 * b) // 3 for f, b in zip(self.fg_color, self.bg_color)
+        )
+        up_color = parse_color(self.up_color)
+        down_color = parse_color(self.down_color)
+
+        draw.text((padding, padding), self.symbol, font=font, fill=self.fg_color)
+        if data.empty:
+            return image
+
+        opens = data["Open"].to_numpy(dtype=float)
+        highs = data["High"].to_numpy(dtype=float)
+        lows = data["Low"].to_numpy(dtype=float)
+        closes = data["Close"].to_numpy(dtype=float)
+
+        low, high = lows.min(), highs.max()
+        if high <= low:
+            high = low + 1
+        labels = ["%.2f" % high, "%.2f" % low]
+
+        top = 2 * padding + line_height
+        bottom = self.height - padding
+        left = padding
+        right = (
+            self.width
+            - 2 * padding
+            - max(draw.textlength(label, font=font) for label in labels)
+        )
+        if self.show_volume and "Volume" in data:
+            # a quarter of the chart for volume bars, below the prices
+            volume_top = bottom - (bottom - top) // 4
+            price_bottom = volume_top - padding
+        else:
+            price_bottom = bottom
+        if price_bottom <= top or right <= left:
+            return image
+
+        draw.line((left, price_bottom, right, price_bottom), fill=axis_color)
+        draw.text(
+            (self.width - padding, top),
+            labels[0],
+            font=font,
+            fill=self.fg_color,
+            anchor="ra",
+        )
+        draw.text(
+            (self.width - padding, price_bottom),
+            labels[1],
+            font=font,
+            fill=self.fg_color,
+            anchor="rd",
+        )
+
+        # map every candle to pixels at once
+        step = (right - left) / len(data)
+        centers = np.round(left + (np.arange(len(data)) + 0.5) * step).astype(int)
+        half_width = max(0, int(step * 0.35))
+        scale = (price_bottom - top) / (high - low)
+        open_y = np.round(price_bottom - (opens - low) * scale).astype(int)
+        close_y = np.round(price_bottom - (closes - low) * scale).astype(int)
+        high_y = np.round(price_bottom - (highs - low) * scale).astype(int)
+        low_y = np.round(price_bottom - (lows - low) * scale).astype(int)
+        rising = closes >= opens
+        body_top = np.minimum(open_y, close_y)
+        body_bottom = np.maximum(open_y, close_y)
+
+        for x, wick_top, wick_bottom, y0, y1, up in zip(
+            centers.tolist(),
+            high_y.tolist(),
+            low_y.tolist(),
+            body_top.tolist(),
+            body_bottom.tolist(),
+            rising.tolist(),
+        ):
+            color = up_color if up else down_color
+            draw.line((x, wick_top, x, wick_bottom), fill=color)
+            draw.rectangle((x - half_width, y0, x + half_width, y1), fill=color)
+
+        if price_bottom != bottom:
+            volumes = np.nan_to_num(data["Volume"].to_numpy(dtype=float))
+            volume_scale = (bottom - volume_top) / (volumes.max() or 1)
+            volume_y = np.round(bottom - volumes * volume_scale).astype(int)
+            for x, y, up in zip(centers.tolist(), volume_y.tolist(), rising.tolist()):
+                draw.rectangle(
+                    (x - half_width, y, x + half_width, bottom),
+                    fill=up_color if up else down_color,
+                )
+
+        return image
+
+    def render_mplfinance(self, data):
         import matplotlib
-        import yfinance as yf
         import mplfinance as mpf
 
         # use agg backend, so we can run in a headless environment
         matplotlib.use("agg")
 
-        # get yf data
-        data = yf.download(
-            tickers=self.symbol, period=self.time_period, interval=self.interval
-        )
-
         # make style
         mc = mpf.make_marketcolors(up=self.up_color, down=self.down_color, inherit=True)
 
@@ -64,30 +185,5 @@ class YFCandlestickWidget(WidgetBase):
 
         buf.seek(0)
 
-        self.image = Image.open(buf)
-        self.image = self.image.resize((self.width, self.height))
-
-        # ensure the image has an alpha channel
-        if not self.image.has_transparency_data:
-            # https://stackoverflow.com/a/46366964
-            a_channel = Image.new("L", self.image.size, 255)
-            self.image.putalpha(a_channel)
-
-        # convert to BGRA format
-        self.bytes = self.image.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.bytes:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
+        image = Image.open(buf)
+        return image.resize((self.width, self.height))
@@ -1,6 +1,7 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from .base import WidgetBase
 from ..util import eval_expr, parse_color
+from ..render_util import get_font
 
 
 class TextWidget(WidgetBase):
@@ -15,26 +16,15 @@ class TextWidget(WidgetBase):
         """
         Write the text into the framebuffer
         """
+        # the text is static, only render it once
+        if self.inputs_unchanged():
+            super().refresh(changed=False)
+            return
+
         image = Image.new("RGBA", (self.width * 2, self.height * 2), self.bg_color)
         draw = ImageDraw.Draw(image)
-        font = ImageFont.load_default(self.size)
+        font = get_font(self.size)
         draw.text((0, 0), self.text, fill=self.fg_color, font=font)
         img_resized = image.resize((self.width, self.height), Image.Resampling.LANCZOS)
-        self.bytes = img_resized.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
+        self.set_image(img_resized)
         super().refresh()
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.has_refreshed:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
@@ -2,7 +2,7 @@ from PIL import Image, ImageDraw, ImageFont, ImageOps
 from .base import WidgetBase
 from ..util import eval_expr, parse_color
 from datetime import datetime as dt
-import requests
+from .. import http_client
 from io import BytesIO
 from ..sfxbox import SimpleFlexBox
 from ..render_util import (
@@ -12,6 +12,9 @@ from ..render_util import (
     rounded_image,
 )
 
+# National Weather Service API
+API_URL = "https://api.weather.gov"
+
 
 def get_keypath(obj, keypath):
     keys = keypath.split(".")
@@ -20,6 +23,17 @@ def get_keypath(obj, keypath):
     return obj
 
 
+def check_response(response, url):
+    """
+    Raise if the National Weather Service answered with an error, rather than failing to parse its error page
+    """
+    if not response.ok:
+        raise ValueError(
+            f"Failed to fetch {url}: {response.status_code} ({response.reason})"
+        )
+    return response
+
+
 class WeatherWidget(WidgetBase):
     def __init__(self, x, y, width, height, config):
         super().__init__(x, y, width, height, config)
@@ -33,31 +47,35 @@ class WeatherWidget(WidgetBase):
         # self.theme = config.get("theme", "light")
         self.latitude = config["latitude"]
         self.longitude = config["longitude"]
+        self.api_url = config.get("api_url", API_URL).rstrip("/")
         self.refresh_interval = 60 * 10
+        self.icon_url = None
+        self.icon_data = None
 
-    def find_font_size(self, test_text, height, width):
-        font_size = 1
-
-        for i in range(height):
-            font = ImageFont.load_default(font_size)
-            length = font.getlength(test_text)
-            if length > 0.9 * width or font_size > 0.9 * height:
-                break
-            font_size += 1
-
-        if font_size > 0.5 * height:
-            font_size = 0.5 * height
-
-        return font_size
-
-    def fetch_data(self):
-        url = f"https://api.weather.gov/points/{self.latitude},{self.longitude}"
-        data = requests.get(url)
-        data = data.json()
-        forecast_url = data["properties"]["forecast"]
-        forecast = requests.get(forecast_url)
+    async def fetch(self):
+        # the forecast office for a location doesn't change, only look it up once
+        url = f"{self.api_url}/points/{self.latitude},{self.longitude}"
+        data = check_response(await self.fetch_url(url, ttl=http_client.FOREVER), url)
+        forecast_url = data.json()["properties"]["forecast"]
+        forecast = check_response(await self.fetch_url(forecast_url), forecast_url)
         self.data = forecast.json()
 
+        # the icon only changes with the forecast, keep it until its url does
+        icon = self.data["properties"]["periods"][0]["icon"]
+        icon = icon.replace("size=medium", "size=large")
+        if icon != self.icon_url:
+            response = await self.fetch_url(icon, ttl=http_client.FOREVER)
+            if response.ok:
+                self.icon_data = response.content
+                self.icon_url = icon
+            elif self.icon_data is None:
+                check_response(response, icon)
+            else:
+                # retried on the next refresh
+                print(
+                    f"Failed to download weather icon from {icon}: {response.status_code} ({response.reason}), keeping the previous one"
+                )
+
     def refresh(self):
         """
         Write the text into the framebuffer
@@ -148,17 +166,21 @@ class WeatherWidget(WidgetBase):
         )
         layout = weather_layout.compute_sizes(0, 0, self.width, self.height)
 
+        self.fetch_if_needed()
+
+        # the forecast document's timestamps change on every fetch, only the current period is drawn
+        if self.inputs_unchanged(self.data["properties"]["periods"][0], self.icon_url):
+            super().refresh(changed=False)
+            return
+
         image = Image.new("RGBA", (self.width, self.height), self.bg_color)
         draw = ImageDraw.Draw(image)
 
-        self.fetch_data()
-
         # print(x, y, self.size)
         temperature = self.data["properties"]["periods"][0]["temperature"]
         temp_unit = self.data["properties"]["periods"][0]["temperatureUnit"]
         period_name = self.data["properties"]["periods"][0]["name"]
         short_forecast = self.data["properties"]["periods"][0]["shortForecast"]
-        icon = self.data["properties"]["periods"][0]["icon"]
 
         if self.debug:
             draw_layout_boxes(
@@ -239,13 +261,8 @@ class WeatherWidget(WidgetBase):
             anchor="lm",
         )
 
-        icon_data = requests.get(icon).content
-        icon_image = Image.open(BytesIO(icon_data))
-        icon_image = icon_image.convert("RGBA")
-
         # paste_image_into_bounds(image, icon_image_masked, layout['icon_box']['content_box'])
-        icon_data = requests.get(icon.replace("size=medium", "size=large")).content
-        icon_image = Image.open(BytesIO(icon_data))
+        icon_image = Image.open(BytesIO(self.icon_data))
         icon_image = icon_image.convert("RGBA")
         icon_image = ImageOps.contain(
             icon_image,
@@ -293,21 +310,5 @@ class WeatherWidget(WidgetBase):
         )
 
         img_resized = image.resize((self.width, self.height), Image.Resampling.LANCZOS)
-        self.bytes = img_resized.tobytes("raw", "BGRA")
-        self.bytes_per_pixel = 4
+        self.set_image(img_resized)
         super().refresh()
-
-    def write_into_fb(self, fb):
-        """
-        Write the image into the framebuffer
-        """
-        if not self.has_refreshed:
-            return
-
-        for y in range(self.height):
-            y_off = y * self.width * self.bytes_per_pixel
-            fb.write_line(
-                self.x,
-                self.y + y,
-                self.bytes[y_off : y_off + self.width * self.bytes_per_pixel],
-            )
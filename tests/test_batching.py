@@ -0,0 +1,34 @@
+from fb_dashboard.batching import Batcher
+from .util import call_concurrently
+
+
+def test_callers_with_the_same_key_share_one_run():
+    runs = []
+
+    def run(key, items):
+        runs.append((key, list(items)))
+        return [item * 10 for item in items]
+
+    batcher = Batcher(run, window=0.1)
+
+    results, errors = call_concurrently(batcher.submit, ("a", 1), ("a", 2), ("b", 3))
+
+    assert errors == [None, None, None]
+    assert results == [10, 20, 30]
+    assert sorted((key, sorted(items)) for key, items in runs) == [
+        ("a", [1, 2]),
+        ("b", [3]),
+    ]
+    assert batcher.pending == {}
+
+
+def test_errors_reach_every_caller():
+    def run(key, items):
+        raise ConnectionError("offline")
+
+    batcher = Batcher(run, window=0.1)
+
+    results, errors = call_concurrently(batcher.submit, ("a", 1), ("a", 2))
+
+    assert results == [None, None]
+    assert [str(e) for e in errors] == ["offline", "offline"]
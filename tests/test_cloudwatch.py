@@ -0,0 +1,215 @@
+from datetime import datetime as dt, timedelta, timezone
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+from fb_dashboard.cloudwatch import (
+    MAX_QUERIES_PER_CALL,
+    MetricDataBatcher,
+    metric_queries,
+    parse_time,
+)
+from .util import call_concurrently
+
+END = dt(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+START = END - timedelta(hours=3)
+
+
+def make_client():
+    return boto3.client(
+        "cloudwatch",
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+
+
+def query(name):
+    return {
+        "MetricStat": {
+            "Metric": {"Namespace": "Test", "MetricName": name, "Dimensions": []},
+            "Period": 300,
+            "Stat": "Average",
+        },
+        "Label": name,
+    }
+
+
+def result(query_id, minutes, values):
+    return {
+        "Id": query_id,
+        "Label": query_id,
+        "Timestamps": [START + timedelta(minutes=m) for m in minutes],
+        "Values": values,
+        "StatusCode": "Complete",
+    }
+
+
+def expected_params(next_token=None):
+    params = {
+        "MetricDataQueries": ANY,
+        "StartTime": START,
+        "EndTime": END,
+        "ScanBy": "TimestampAscending",
+    }
+    if next_token:
+        params["NextToken"] = next_token
+    return params
+
+
+def get_concurrently(batcher, *query_lists):
+    return call_concurrently(
+        batcher.get_metric_data, *((queries, START, END) for queries in query_lists)
+    )
+
+
+def test_widgets_refreshing_together_share_one_call():
+    client = make_client()
+    batcher = MetricDataBatcher(client, window=0.1)
+
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "get_metric_data",
+            {
+                "MetricDataResults": [
+                    result("m0", [0], [1.0]),
+                    result("m1", [0], [2.0]),
+                    result("m2", [0], [3.0]),
+                ]
+            },
+            expected_params(),
+        )
+        results, errors = get_concurrently(
+            batcher, [query("a")], [query("b"), query("c")]
+        )
+        stubber.assert_no_pending_responses()
+
+    assert errors == [None, None]
+    assert batcher.calls == 1
+    assert batcher.queries == 3
+    # each widget gets its own series back, in the order it asked for them, whichever joined the batch first
+    assert [label for label, _, _ in results[0]] == ["a"]
+    assert [label for label, _, _ in results[1]] == ["b", "c"]
+    values = [values[0] for _, _, values in results[0] + results[1]]
+    assert sorted(values) == [1.0, 2.0, 3.0]
+    assert values[2] == values[1] + 1
+
+
+def test_pages_are_joined_per_query():
+    client = make_client()
+    batcher = MetricDataBatcher(client, window=0)
+
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "get_metric_data",
+            {
+                "MetricDataResults": [
+                    result("m0", [0, 5], [1.0, 2.0]),
+                    result("m1", [0], [10.0]),
+                ],
+                "NextToken": "page-2",
+            },
+            expected_params(),
+        )
+        stubber.add_response(
+            "get_metric_data",
+            {
+                "MetricDataResults": [
+                    result("m0", [10], [3.0]),
+                    result("m1", [5, 10], [20.0, 30.0]),
+                ]
+            },
+            expected_params(next_token="page-2"),
+        )
+        series = batcher.get_metric_data([query("a"), query("b")], START, END)
+        stubber.assert_no_pending_responses()
+
+    assert batcher.calls == 2
+    assert [(label, values) for label, _, values in series] == [
+        ("a", [1.0, 2.0, 3.0]),
+        ("b", [10.0, 20.0, 30.0]),
+    ]
+    assert series[0][1] == [START + timedelta(minutes=m) for m in (0, 5, 10)]
+
+
+def test_large_batches_are_split_into_calls():
+    client = make_client()
+    batcher = MetricDataBatcher(client, window=0)
+    count = MAX_QUERIES_PER_CALL + 2
+
+    with Stubber(client) as stubber:
+        for first, last in ((0, MAX_QUERIES_PER_CALL), (MAX_QUERIES_PER_CALL, count)):
+            stubber.add_response(
+                "get_metric_data",
+                {
+                    "MetricDataResults": [
+                        result("m%d" % i, [0], [float(i)]) for i in range(first, last)
+                    ]
+                },
+                expected_params(),
+            )
+        series = batcher.get_metric_data(
+            [query("q%d" % i) for i in range(count)], START, END
+        )
+        stubber.assert_no_pending_responses()
+
+    assert (batcher.calls, batcher.queries) == (2, count)
+    assert [values for _, _, values in series] == [[float(i)] for i in range(count)]
+
+
+def test_errors_reach_every_widget_in_the_batch():
+    client = make_client()
+    batcher = MetricDataBatcher(client, window=0.1)
+
+    with Stubber(client) as stubber:
+        stubber.add_client_error("get_metric_data", "Throttling", "Rate exceeded", 400)
+        results, errors = get_concurrently(batcher, [query("a")], [query("b")])
+
+    assert results == [None, None]
+    assert all("Rate exceeded" in str(e) for e in errors)
+
+    # the failed batch is gone, the next refresh asks again
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "get_metric_data",
+            {"MetricDataResults": [result("m0", [0], [1.0])]},
+            expected_params(),
+        )
+        series = batcher.get_metric_data([query("a")], START, END)
+
+    assert series[0][2] == [1.0]
+
+
+def test_metric_queries_repeat_dots_from_the_previous_metric():
+    widget = {
+        "period": 60,
+        "stat": "Sum",
+        "metrics": [
+            ["AWS/ELB", "RequestCount", "LoadBalancer", "a"],
+            [".", ".", ".", "b", {"label": "B", "stat": "Average"}],
+        ],
+    }
+
+    first, second = metric_queries(widget)
+
+    assert first["MetricStat"]["Metric"] == {
+        "Namespace": "AWS/ELB",
+        "MetricName": "RequestCount",
+        "Dimensions": [{"Name": "LoadBalancer", "Value": "a"}],
+    }
+    assert (first["MetricStat"]["Period"], first["MetricStat"]["Stat"]) == (60, "Sum")
+    assert second["MetricStat"]["Metric"]["Dimensions"] == [
+        {"Name": "LoadBalancer", "Value": "b"}
+    ]
+    assert (second["Label"], second["MetricStat"]["Stat"]) == ("B", "Average")
+
+
+def test_metric_math_is_rejected():
+    with pytest.raises(ValueError):
+        metric_queries({"metrics": [[{"expression": "m1 * 2"}]]})
+
+
+def test_parse_time():
+    assert parse_time("-PT3H", END) == START
+    assert parse_time("-P1DT30M", END) == END - timedelta(days=1, minutes=30)
+    assert parse_time("P0D", END) == END
+    assert parse_time("2026-10-18T09:00:00Z", END) == START
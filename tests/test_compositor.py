@@ -0,0 +1,105 @@
+from fb_dashboard.compositor import Compositor, clip_rect, rects_intersect
+from fb_dashboard.framebuffer import FrameBufferBase
+
+WIDTH = 8
+HEIGHT = 4
+
+
+class RecordingFrameBuffer(FrameBufferBase):
+    def __init__(self):
+        """
+        A framebuffer in memory, that records the rects of every swap
+        """
+        super().__init__(WIDTH, HEIGHT, export_filename=None)
+        self.swaps = []
+
+    def swap_buffers(self, rects=None):
+        self.swaps.append(rects)
+
+
+class SolidWidget:
+    def __init__(self, x, y, width, height, value):
+        """
+        Just enough of a widget for the compositor, filled with one byte value
+        """
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.value = value
+        self.generation = 0
+        self.writes = 0
+
+    def write_into_fb(self, fb):
+        self.writes += 1
+        fb.blit(
+            self.x,
+            self.y,
+            self.width,
+            self.height,
+            bytes([self.value]) * (self.width * self.height * fb.bytes_per_pixel),
+        )
+
+
+def pixel(fb, x, y):
+    offset = y * fb.stride + x * fb.bytes_per_pixel
+    return fb.virtual_buffer[offset]
+
+
+def test_first_frame_swaps_everything():
+    fb = RecordingFrameBuffer()
+    widget = SolidWidget(0, 0, 2, 2, 1)
+
+    assert Compositor(fb, [widget]).compose() == [(0, 0, 2, 2)]
+    assert fb.swaps == [None]
+
+
+def test_only_changed_widgets_are_redrawn():
+    fb = RecordingFrameBuffer()
+    left, right = SolidWidget(0, 0, 4, 4, 1), SolidWidget(4, 0, 4, 4, 2)
+    compositor = Compositor(fb, [left, right])
+    compositor.compose()
+
+    assert compositor.compose() == []
+    assert fb.swaps == [None]
+
+    right.generation += 1
+    assert compositor.compose() == [(4, 0, 4, 4)]
+    assert (left.writes, right.writes) == (1, 2)
+    assert fb.swaps[-1] == [(4, 0, 4, 4)]
+
+
+def test_later_overlapping_widgets_are_drawn_again_on_top():
+    fb = RecordingFrameBuffer()
+    below = SolidWidget(0, 0, 4, 4, 1)
+    above = SolidWidget(2, 2, 4, 2, 2)
+    elsewhere = SolidWidget(6, 0, 2, 2, 3)
+    compositor = Compositor(fb, [below, above, elsewhere])
+    compositor.compose()
+
+    below.generation += 1
+    dirty = compositor.compose()
+
+    assert dirty == [(0, 0, 4, 4), (2, 2, 4, 2)]
+    assert (below.writes, above.writes, elsewhere.writes) == (2, 2, 1)
+    assert pixel(fb, 3, 3) == 2
+    assert pixel(fb, 1, 1) == 1
+
+
+def test_widgets_are_clipped_to_the_screen():
+    fb = RecordingFrameBuffer()
+    overflowing = SolidWidget(6, 2, 4, 4, 1)
+    offscreen = SolidWidget(WIDTH, 0, 2, 2, 2)
+
+    dirty = Compositor(fb, [overflowing, offscreen]).compose()
+
+    assert dirty == [(6, 2, 2, 2)]
+    assert offscreen.writes == 0
+    assert pixel(fb, 7, 3) == 1
+    # nothing wrapped around into the next row
+    assert pixel(fb, 0, 3) == 0
+
+
+def test_clip_rect_and_intersection():
+    assert clip_rect((-2, -2, 4, 4), WIDTH, HEIGHT) == (0, 0, 2, 2)
+    assert clip_rect((WIDTH, 0, 1, 1), WIDTH, HEIGHT) is None
+    assert rects_intersect((0, 0, 2, 2), (1, 1, 2, 2))
+    # touching edges don't overlap
+    assert not rects_intersect((0, 0, 2, 2), (2, 0, 2, 2))
@@ -0,0 +1,143 @@
+import pytest
+from fb_dashboard.framebuffer import (
+    FB_VAR_SCREENINFO,
+    FB_VAR_YOFFSET,
+    FBIOGET_VSCREENINFO,
+    FBIOPAN_DISPLAY,
+    LinuxFrameBuffer,
+)
+
+WIDTH = 8
+HEIGHT = 4
+PAGE_SIZE = WIDTH * HEIGHT * 4
+
+WHITE = b"\xff\xff\xff\xff"
+BLACK = b"\x00\x00\x00\xff"
+
+
+class FakeDevice:
+    def __init__(self, virtual_height, supports_ioctls=True):
+        """
+        Answers the framebuffer ioctls like a 32 bit BGRA device with HEIGHT visible rows, and records every pan
+        """
+        self.virtual_height = virtual_height
+        self.supports_ioctls = supports_ioctls
+        self.pans = []
+
+    def ioctl(self, fd, request, arg):
+        if not self.supports_ioctls:
+            raise OSError("Inappropriate ioctl for device")
+
+        if request == FBIOGET_VSCREENINFO:
+            var = [0] * 40
+            var[0], var[1] = WIDTH, HEIGHT
+            var[2], var[3] = WIDTH, self.virtual_height
+            var[6] = 32
+            # (offset, length) of red, green, blue and transparency
+            var[8:10], var[11:13], var[14:16], var[17:19] = (
+                (16, 8),
+                (8, 8),
+                (0, 8),
+                (24, 8),
+            )
+            return FB_VAR_SCREENINFO.pack(*var)
+
+        if request == FBIOPAN_DISPLAY:
+            self.pans.append(FB_VAR_SCREENINFO.unpack(arg)[FB_VAR_YOFFSET])
+            return arg
+
+        raise OSError("Unknown ioctl")
+
+
+def make_framebuffer(tmp_path, device, page_flip=True):
+    sysfs = tmp_path / "sysfs"
+    sysfs.mkdir()
+    (sysfs / "virtual_size").write_text("%d,%d\n" % (WIDTH, device.virtual_height))
+    (sysfs / "bits_per_pixel").write_text("32\n")
+
+    device_path = tmp_path / "fb0"
+    device_path.write_bytes(bytes(WIDTH * device.virtual_height * 4))
+
+    return LinuxFrameBuffer(
+        "fb0",
+        page_flip=page_flip,
+        device_path=str(device_path),
+        sysfs_path=str(sysfs),
+        ioctl=device.ioctl,
+    )
+
+
+def pixel(page, x, y):
+    offset = (y * WIDTH + x) * 4
+    return bytes(page[offset : offset + 4])
+
+
+def test_page_flip_pans_to_the_drawn_page(tmp_path):
+    device = FakeDevice(virtual_height=2 * HEIGHT)
+    fb = make_framebuffer(tmp_path, device)
+
+    assert fb.page_flip
+    assert device.pans == [0]
+    # drawing goes straight into the hidden page
+    assert fb.virtual_buffer.obj is fb.fb
+
+    fb.blit(2, 1, 2, 2, WHITE * 4)
+    fb.swap_buffers([(2, 1, 2, 2)])
+
+    assert device.pans == [0, HEIGHT]
+    assert fb.front_page == 1
+    front = fb.page(1)
+    assert pixel(front, 2, 1) == WHITE
+    assert pixel(front, 0, 0) == BLACK
+
+    # the new back page was brought up to date, and is drawn into next
+    back = fb.page(0)
+    assert pixel(back, 3, 2) == WHITE
+    assert fb.virtual_buffer.tobytes() == back.tobytes()
+
+    fb.blit(0, 0, 1, 1, WHITE)
+    fb.swap_buffers([(0, 0, 1, 1)])
+
+    assert device.pans == [0, HEIGHT, 0]
+    assert pixel(fb.page(0), 0, 0) == WHITE
+    assert pixel(fb.page(1), 0, 0) == WHITE
+    assert pixel(fb.page(1), 2, 1) == WHITE
+
+
+def test_swap_without_changes_doesnt_flip(tmp_path):
+    device = FakeDevice(virtual_height=2 * HEIGHT)
+    fb = make_framebuffer(tmp_path, device)
+
+    fb.swap_buffers([])
+
+    assert device.pans == [0]
+    assert fb.front_page == 0
+
+
+@pytest.mark.parametrize(
+    "device, page_flip",
+    [
+        (FakeDevice(virtual_height=2 * HEIGHT, supports_ioctls=False), True),
+        (FakeDevice(virtual_height=HEIGHT), True),
+        (FakeDevice(virtual_height=2 * HEIGHT), False),
+    ],
+    ids=["no ioctls", "single page", "page flip off"],
+)
+def test_copy_fallback_only_copies_dirty_rects(tmp_path, device, page_flip):
+    fb = make_framebuffer(tmp_path, device, page_flip=page_flip)
+
+    assert not fb.page_flip
+    assert fb.virtual_buffer.obj is not fb.fb
+
+    fb.blit(0, 0, WIDTH, HEIGHT, WHITE * WIDTH * HEIGHT)
+    fb.swap_buffers([(1, 1, 2, 1)])
+
+    visible = memoryview(fb.fb)[:PAGE_SIZE]
+    assert pixel(visible, 1, 1) == WHITE
+    assert pixel(visible, 2, 1) == WHITE
+    assert pixel(visible, 0, 0) == bytes(4)
+    assert pixel(visible, 3, 1) == bytes(4)
+    assert device.pans == []
+
+    fb.swap_buffers()
+    assert bytes(visible) == WHITE * WIDTH * HEIGHT
@@ -0,0 +1,164 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from fb_dashboard import http_client
+from fb_dashboard.widgets.base import WidgetBase
+
+
+class Server:
+    def __init__(self):
+        """
+        Serves `body` with an ETag on localhost, answering conditional requests with 304, and records the headers of every request
+        """
+        self.body = b"first"
+        self.requests = []
+        self.delay = 0
+        # hang up without answering, like a server that went away
+        self.down = False
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:%d/data" % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if server.down:
+                    self.close_connection = True
+                    return
+                time.sleep(server.delay)
+                etag = '"%d"' % hash(server.body)
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "CACHE_DIR", str(tmp_path))
+    server = Server()
+    yield server
+    server.stop()
+
+
+def wait_for_revalidations():
+    for _ in range(100):
+        if not http_client._revalidations:
+            return
+        time.sleep(0.01)
+    raise AssertionError("revalidation didn't finish")
+
+
+def test_fresh_responses_are_served_from_the_cache(server):
+    first = http_client.get(server.url, cache_ttl=60)
+    second = http_client.get(server.url, cache_ttl=60)
+
+    assert (first.content, second.content) == (b"first", b"first")
+    assert not second.stale
+    assert len(server.requests) == 1
+
+
+def test_expired_responses_are_revalidated(server):
+    http_client.get(server.url, cache_ttl=0)
+    entry = http_client.CacheEntry.load(http_client.cache_key(server.url, None, None))
+
+    unchanged = http_client.get(server.url, cache_ttl=0)
+
+    assert server.requests[-1]["If-None-Match"] == entry.headers["ETag"]
+    assert unchanged.content == b"first"
+    refreshed = http_client.CacheEntry.load(entry.key)
+    assert refreshed.stored > entry.stored
+
+    server.body = b"second"
+    changed = http_client.get(server.url, cache_ttl=0)
+
+    assert changed.content == b"second"
+    assert len(server.requests) == 3
+
+
+def test_stale_responses_are_served_while_revalidating(server):
+    http_client.get(server.url, cache_ttl=0)
+    server.body = b"second"
+    server.delay = 0.1
+
+    start = time.perf_counter()
+    stale = http_client.get(server.url, cache_ttl=0, max_stale=60)
+
+    assert time.perf_counter() - start < server.delay
+    assert (stale.content, stale.stale) == (b"first", True)
+
+    wait_for_revalidations()
+    server.delay = 0
+    fresh = http_client.get(server.url, cache_ttl=60, max_stale=60)
+    assert (fresh.content, fresh.stale) == (b"second", False)
+
+
+def test_cached_response_is_used_when_the_server_is_down(server):
+    http_client.get(server.url, cache_ttl=0)
+    server.down = True
+
+    response = http_client.get(server.url, cache_ttl=0, timeout=1)
+
+    assert (response.content, response.stale) == (b"first", True)
+
+
+def test_spooled_responses_come_from_the_cache_file(server):
+    first = http_client.get(server.url, cache_ttl=60, spool=True)
+    second = http_client.get(server.url, cache_ttl=60, spool=True)
+
+    with first.body, second.body:
+        assert first.body.read() == second.body.read() == b"first"
+    assert first.digest == second.digest
+
+
+def test_headers_and_auth_get_their_own_entries(server):
+    keys = {
+        http_client.cache_key(server.url, None, None),
+        http_client.cache_key(server.url, {"Accept": "text/plain"}, None),
+        http_client.cache_key(server.url, None, http_client.basic_auth("a", "x")),
+        http_client.cache_key(server.url, None, http_client.basic_auth("b", "x")),
+    }
+    assert len(keys) == 4
+
+    http_client.get(server.url, cache_ttl=60)
+    http_client.get(server.url, cache_ttl=60, headers={"Accept": "text/plain"})
+    assert len(server.requests) == 2
+
+
+def test_widgets_only_cache_authenticated_responses_when_asked(server, tmp_path):
+    auth = http_client.basic_auth("user", "secret")
+    private = WidgetBase(0, 0, 1, 1, {})
+    shared = WidgetBase(0, 0, 1, 1, {"http_cache_auth": "True"})
+
+    for _ in range(2):
+        http_client.run(private.fetch_url(server.url, ttl=60, auth=auth))
+    assert len(server.requests) == 2
+    assert list(tmp_path.iterdir()) == []
+
+    for _ in range(2):
+        http_client.run(shared.fetch_url(server.url, ttl=60, auth=auth))
+    assert len(server.requests) == 3
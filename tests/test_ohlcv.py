@@ -0,0 +1,160 @@
+import time
+from datetime import datetime as dt, timedelta, timezone
+import pandas as pd
+import pytest
+from fb_dashboard.ohlcv import COLUMNS, OHLCVStore
+from .util import call_concurrently
+
+
+def bars(start, count):
+    """
+    Daily bars from `start`, with the close counting up from the day of the year
+    """
+    index = pd.date_range(start, periods=count, freq="D", tz="UTC")
+    close = [float(day.dayofyear) for day in index]
+    return pd.DataFrame(
+        {
+            "Open": close,
+            "High": [c + 1 for c in close],
+            "Low": [c - 1 for c in close],
+            "Close": close,
+            "Volume": [100.0] * count,
+        },
+        index=index,
+    )[COLUMNS]
+
+
+class FakeSource:
+    def __init__(self, frame, delay=0):
+        """
+        Serves the same bars for every symbol, and records every download
+        """
+        self.frame = frame
+        self.delay = delay
+        self.calls = []
+        self.error = None
+
+    def download(self, symbols, interval, period=None, start=None):
+        self.calls.append((list(symbols), interval, period, start))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        frame = self.frame
+        if start is not None:
+            frame = frame[frame.index >= pd.Timestamp(start)]
+        return {symbol: frame for symbol in symbols}
+
+
+def today():
+    return dt.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def test_concurrent_symbols_share_one_download(tmp_path):
+    source = FakeSource(bars(today() - timedelta(days=20), 21))
+    store = OHLCVStore(str(tmp_path), source, window=0.1)
+
+    results, errors = call_concurrently(
+        store.get, ("AAA", "1d", "1mo"), ("BBB", "1d", "1mo"), ("CCC", "1d", "1mo")
+    )
+
+    assert errors == [None, None, None]
+    assert source.calls == [(["AAA", "BBB", "CCC"], "1d", "1mo", None)]
+    assert store.downloads == 1
+    for frame in results:
+        assert len(frame) == 21
+
+
+def test_download_error_reaches_every_widget_in_the_batch(tmp_path):
+    source = FakeSource(bars(today(), 1))
+    source.error = ConnectionError("offline")
+    store = OHLCVStore(str(tmp_path), source, window=0.1)
+
+    _, errors = call_concurrently(store.get, ("AAA", "1d", "1mo"), ("BBB", "1d", "1mo"))
+
+    assert len(source.calls) == 1
+    assert [str(e) for e in errors] == ["offline", "offline"]
+    assert store.downloads == 0
+
+
+def test_missing_symbol_raises(tmp_path):
+    class EmptySource(FakeSource):
+        def download(self, symbols, interval, period=None, start=None):
+            return {}
+
+    store = OHLCVStore(str(tmp_path), EmptySource(None), window=0)
+
+    with pytest.raises(ValueError, match="No data for AAA"):
+        store.get("AAA", "1d", "1mo")
+
+
+def test_incremental_download_starts_at_the_last_bar(tmp_path):
+    history = bars(today() - timedelta(days=20), 21)
+    source = FakeSource(history.iloc[:-2])
+    store = OHLCVStore(str(tmp_path), source, window=0)
+
+    first = store.get("AAA", "1d", "1mo")
+    assert len(first) == 19
+
+    # the last cached bar was still open, and two more days have passed
+    updated = history.copy()
+    updated.iloc[18, updated.columns.get_loc("Close")] = -1.0
+    source.frame = updated
+    second = store.get("AAA", "1d", "1mo")
+
+    last_cached = history.index[18].to_pydatetime()
+    assert source.calls[-1] == (["AAA"], "1d", None, last_cached)
+    assert len(second) == 21
+    assert second["Close"].iloc[18] == -1.0
+    assert (second.index == history.index).all()
+
+    # a new store reads the merged bars back from disk
+    reloaded = OHLCVStore(str(tmp_path), FakeSource(updated.iloc[-1:]), window=0)
+    assert len(reloaded.get("AAA", "1d", "1mo")) == 21
+
+
+def test_longer_period_downloads_everything_again(tmp_path):
+    source = FakeSource(bars(today() - timedelta(days=200), 201))
+    store = OHLCVStore(str(tmp_path), source, window=0)
+
+    assert len(store.get("AAA", "1d", "1mo")) == 31
+    assert len(store.get("AAA", "1d", "6mo")) == 186
+    assert [call[2] for call in source.calls] == ["1mo", "6mo"]
+
+
+def test_same_symbol_refreshes_dont_drop_bars(tmp_path):
+    history = bars(today() - timedelta(days=20), 21)
+    source = FakeSource(history.iloc[:10], delay=0.05)
+    store = OHLCVStore(str(tmp_path), source, window=0)
+    store.get("AAA", "1d", "1mo")
+
+    source.frame = history
+    results, errors = call_concurrently(
+        store.get, ("AAA", "1d", "1mo"), ("AAA", "1d", "1mo")
+    )
+
+    assert errors == [None, None]
+    for frame in results:
+        assert len(frame) == 21
+    records, _ = store.load("AAA", "1d")
+    assert len(records) == 21
+
+
+def test_no_new_bars_keeps_the_cached_ones(tmp_path):
+    class ClosedMarketSource(FakeSource):
+        def download(self, symbols, interval, period=None, start=None):
+            if start is not None:
+                # yfinance leaves out symbols without bars in the range
+                self.calls.append((list(symbols), interval, period, start))
+                return {}
+            return super().download(symbols, interval, period, start)
+
+    source = ClosedMarketSource(bars(today() - timedelta(days=20), 21))
+    store = OHLCVStore(str(tmp_path), source, window=0)
+    store.get("AAA", "1d", "1mo")
+
+    frame = store.get("AAA", "1d", "1mo")
+
+    assert source.calls[-1][3] is not None
+    assert len(frame) == 21
+    records, _ = store.load("AAA", "1d")
+    assert len(records) == 21
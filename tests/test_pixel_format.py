@@ -0,0 +1,83 @@
+import pytest
+from PIL import Image
+from fb_dashboard.pixel_format import PixelFormat
+
+COLORS = [(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (16, 32, 64, 128)]
+
+
+def image_of(colors):
+    image = Image.new("RGBA", (len(colors), 1))
+    image.putdata(colors)
+    return image
+
+
+def test_pack_color_bgra():
+    pixel_format = PixelFormat.from_bits_per_pixel(32)
+
+    assert pixel_format.raw_mode == ("RGBA", "BGRA")
+    assert pixel_format.pack_color((1, 2, 3, 4)) == bytes([3, 2, 1, 4])
+
+
+def test_pack_color_rgb565():
+    pixel_format = PixelFormat.from_bits_per_pixel(16)
+
+    assert pixel_format.raw_mode is None
+    assert pixel_format.pack_color((255, 0, 0, 255)) == (0xF800).to_bytes(2, "little")
+    assert pixel_format.pack_color((0, 255, 0, 255)) == (0x07E0).to_bytes(2, "little")
+    assert pixel_format.pack_color((0, 0, 255, 255)) == (0x001F).to_bytes(2, "little")
+
+
+@pytest.mark.parametrize(
+    "pixel_format",
+    [
+        PixelFormat.from_bits_per_pixel(32),
+        PixelFormat.from_bits_per_pixel(24),
+        PixelFormat.from_bits_per_pixel(16),
+        # no PIL raw mode, packed with numpy
+        PixelFormat(32, (24, 8), (16, 8), (8, 8), (0, 8)),
+    ],
+    ids=["bgra", "bgr", "rgb565", "abgr"],
+)
+def test_tobytes_matches_pack_color(pixel_format):
+    data = pixel_format.tobytes(image_of(COLORS))
+
+    assert data == b"".join(pixel_format.pack_color(color) for color in COLORS)
+
+
+def pixels(image):
+    return [image.getpixel((x, 0)) for x in range(image.width)]
+
+
+@pytest.mark.parametrize(
+    "pixel_format",
+    [
+        PixelFormat.from_bits_per_pixel(32),
+        PixelFormat.from_bits_per_pixel(24),
+        # the padding byte isn't a channel
+        PixelFormat(32, (0, 8), (8, 8), (16, 8)),
+    ],
+    ids=["bgra", "bgr", "rgbx"],
+)
+def test_to_image_round_trips(pixel_format):
+    colors = [(r, g, b, 255) for r, g, b, _ in COLORS]
+
+    image = pixel_format.to_image(pixel_format.tobytes(image_of(colors)), 4, 1)
+
+    assert pixels(image) == colors
+
+
+def test_rgb565_round_trip_keeps_the_top_bits():
+    pixel_format = PixelFormat.from_bits_per_pixel(16)
+
+    image = pixel_format.to_image(pixel_format.tobytes(image_of(COLORS)), 4, 1)
+
+    assert pixels(image)[:3] == [
+        (255, 0, 0, 255),
+        (0, 255, 0, 255),
+        (0, 0, 255, 255),
+    ]
+
+
+def test_unsupported_depth():
+    with pytest.raises(ValueError):
+        PixelFormat.from_bits_per_pixel(8)
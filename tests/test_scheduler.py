@@ -0,0 +1,122 @@
+import time
+import pytest
+from fb_dashboard.scheduler import Scheduler
+from fb_dashboard.widgets.base import RETRY_INTERVAL, WidgetBase
+
+
+class FakeWidget:
+    def __init__(self, due, overlapping=False):
+        """
+        Due at a given time, and counts the refreshes the scheduler starts
+        """
+        self.due = due
+        self.overlapping = overlapping
+        self.started = 0
+        self.refresh_callback = None
+
+    def next_refresh_time(self):
+        return self.due
+
+    def refresh_in_bg(self):
+        self.started += 1
+        # like last_refresh_attempt, an overlapping refresh is due again after the interval
+        self.due = time.time() + 60
+        return True
+
+    def can_refresh_in_bg(self):
+        return self.overlapping
+
+
+def test_due_widgets_start_in_deadline_order():
+    now = time.time()
+    later, first, second = FakeWidget(now + 60), FakeWidget(now - 2), FakeWidget(now)
+    scheduler = Scheduler([later, first, second])
+    order = []
+    first.refresh_in_bg = lambda: order.append("first") or True
+    second.refresh_in_bg = lambda: order.append("second") or True
+
+    scheduler.start_due_refreshes()
+
+    assert order == ["first", "second"]
+    assert later.started == 0
+    # only the widget that isn't due is still queued, the others wait for their refresh to finish
+    assert [widget for _, _, widget in scheduler.queue] == [later]
+
+
+def test_finished_widgets_are_rescheduled():
+    widget = FakeWidget(time.time())
+    scheduler = Scheduler([widget])
+    scheduler.start_due_refreshes()
+    assert scheduler.queue == []
+
+    widget.due = time.time() + 60
+    widget.refresh_callback(widget)
+
+    assert scheduler.wait() == [widget]
+    assert [due for due, _, _ in scheduler.queue] == [widget.due]
+
+
+def test_overlapping_widgets_stay_scheduled():
+    widget = FakeWidget(time.time(), overlapping=True)
+    scheduler = Scheduler([widget])
+
+    scheduler.start_due_refreshes()
+
+    assert widget.started == 1
+    assert len(scheduler.queue) == 1
+
+
+def test_wait_sleeps_until_the_next_deadline():
+    scheduler = Scheduler([FakeWidget(time.time() + 0.05)])
+
+    start = time.perf_counter()
+    assert scheduler.wait() == []
+    assert time.perf_counter() - start >= 0.04
+
+
+def make_widget(refresh_interval):
+    return WidgetBase(0, 0, 1, 1, {"refresh_interval": str(refresh_interval)})
+
+
+def test_failed_refresh_retries_soon():
+    widget = make_widget(600)
+    widget.last_refresh_attempt = 1000.0
+
+    assert widget.next_refresh_time() == 1000.0 + RETRY_INTERVAL
+
+    # never later than the widget's own interval
+    widget.refresh_interval = 2
+    assert widget.next_refresh_time() == 1002.0
+
+
+@pytest.mark.parametrize(
+    "stale_refreshes, delay",
+    [
+        (1, RETRY_INTERVAL),
+        (2, RETRY_INTERVAL * 2),
+        (4, RETRY_INTERVAL * 8),
+        (20, 600),
+    ],
+)
+def test_stale_content_backs_off_up_to_the_refresh_interval(stale_refreshes, delay):
+    widget = make_widget(600)
+    widget.refresh()
+    widget.last_refresh_attempt = widget.last_refresh.timestamp()
+    widget.stale = True
+    widget.stale_refreshes = stale_refreshes
+
+    assert widget.next_refresh_time() == widget.last_refresh.timestamp() + delay
+
+
+def test_stale_refreshes_count_up_and_reset():
+    widget = make_widget(600)
+    widget.stale = True
+    widget.refresh()
+    widget.refresh()
+    assert widget.stale_refreshes == 2
+
+    widget.stale = False
+    widget.refresh()
+    widget.last_refresh_attempt = widget.last_refresh.timestamp()
+    assert widget.stale_refreshes == 0
+    assert widget.next_refresh_time() == widget.last_refresh.timestamp() + 600
@@ -0,0 +1,82 @@
+import pytest
+from PIL import Image
+from fb_dashboard.pixel_format import PixelFormat
+from fb_dashboard.widgets.base import WidgetBase
+
+
+class ColorWidget(WidgetBase):
+    def __init__(self):
+        """
+        Fills itself with `color`, and skips rendering when `key` is unchanged
+        """
+        super().__init__(0, 0, 4, 2, {})
+        self.key = "a"
+        self.color = "red"
+        self.fail = False
+
+    def refresh(self):
+        if self.inputs_unchanged(self.key):
+            super().refresh(changed=False)
+            return
+
+        if self.fail:
+            raise RuntimeError("render failed")
+        self.set_image(Image.new("RGBA", (self.width, self.height), self.color))
+        super().refresh()
+
+
+def test_unchanged_inputs_skip_rendering():
+    widget = ColorWidget()
+    widget.refresh()
+    widget.refresh()
+
+    assert widget.render_stats() == {
+        "renders": 1,
+        "skipped_renders": 1,
+        "unchanged_frames": 0,
+    }
+    assert widget.generation == 1
+
+
+def test_identical_frames_dont_bump_the_generation():
+    widget = ColorWidget()
+    widget.refresh()
+    frame = widget.bytes
+
+    widget.key = "b"
+    widget.refresh()
+
+    assert widget.render_stats()["unchanged_frames"] == 1
+    assert widget.generation == 1
+    assert widget.bytes is frame
+
+    widget.key = "c"
+    widget.color = "blue"
+    widget.refresh()
+
+    assert widget.generation == 2
+    assert widget.bytes != frame
+
+
+def test_failed_render_is_retried_with_the_same_inputs():
+    widget = ColorWidget()
+    widget.fail = True
+    with pytest.raises(RuntimeError):
+        widget.refresh()
+
+    widget.fail = False
+    widget.refresh()
+
+    assert widget.render_stats()["skipped_renders"] == 0
+    assert widget.generation == 1
+
+
+def test_pixel_format_is_part_of_the_inputs():
+    widget = ColorWidget()
+    widget.refresh()
+
+    widget.pixel_format = PixelFormat.from_bits_per_pixel(16)
+    widget.refresh()
+
+    assert widget.render_stats()["renders"] == 2
+    assert len(widget.bytes) == 4 * 2 * 2
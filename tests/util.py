@@ -0,0 +1,25 @@
+import threading
+
+
+def call_concurrently(fn, *calls):
+    """
+    Call fn with each tuple of arguments on its own thread, like widgets refreshing together. Returns the results and errors in order.
+    """
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+
+    def call(index, args):
+        try:
+            results[index] = fn(*args)
+        except Exception as e:
+            errors[index] = e
+
+    threads = [
+        threading.Thread(target=call, args=(index, args))
+        for index, args in enumerate(calls)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors